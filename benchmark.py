@@ -0,0 +1,414 @@
+"""Throughput benchmark for the portfolio ETL pipeline.
+
+Generates synthetic payloads in every source format (Walmart orders JSON,
+Houzz XML, Faire, WooCommerce, DSCO, Mirakl, Wayfair GraphQL and the
+CSV/XLS exports), then times each process_* function, the concat, dedupe
+and normalize tail, bundle expansion, the sharded multi-process transform
+and the stock update separately,
+reporting rows/sec and peak traced memory. With --http the API connectors are
+also run end to end against a local stub server that serves the same
+payloads page by page.
+
+Everything runs inside a temporary directory laid out like production
+(./skus, ../sales, ../cloudbbeh), so no real state or output is touched.
+
+    python benchmark.py --lines 1000 100000 1000000 --http --json bench.json
+"""
+import argparse
+import bisect
+import datetime
+import importlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+SITES = ['Brand1', 'brand2', 'brand3']
+LINES_PER_ORDER = 2
+
+# Synthetic orders are stamped from here, half a second apart, so a million
+# lines stay inside the default 7-day extraction window.
+ORDER_EPOCH = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0) - datetime.timedelta(days=6)
+ORDER_SPACING = datetime.timedelta(milliseconds=500)
+
+
+def load_pipeline():
+    """Import the pipeline module; deferred so --help works without its dependencies."""
+    return importlib.import_module('portfolio_etl')
+
+
+# -- synthetic payloads -------------------------------------------------------
+
+def sku_pool(size):
+    # canonical_sku drops anything containing a junk marker such as "sku", so avoid those in names.
+    return [f'RT-{i:06d}' for i in range(size)]
+
+
+def order_lines(lines, skus, rng):
+    """Yield (order_number, [(sku, qty), ...]) with LINES_PER_ORDER lines per order."""
+    for order_number, start in enumerate(range(0, lines, LINES_PER_ORDER)):
+        count = min(LINES_PER_ORDER, lines - start)
+        yield order_number, [(rng.choice(skus), rng.randint(1, 4)) for _ in range(count)]
+
+
+def created_at(order_number):
+    """The creation time of a synthetic order, increasing with its number."""
+    return ORDER_EPOCH + order_number * ORDER_SPACING
+
+
+def walmart_orders(orders):
+    return [
+        {'purchaseOrderId': str(number), 'orderLines': {'orderLine': [
+            {'lineNumber': str(i + 1), 'item': {'sku': sku}, 'orderLineQuantity': {'amount': str(qty)}}
+            for i, (sku, qty) in enumerate(lines)
+        ]}}
+        for number, lines in orders
+    ]
+
+
+def walmart_page(orders, next_cursor=None):
+    return {'list': {'meta': {'nextCursor': next_cursor}, 'elements': {'order': walmart_orders(orders)}}}
+
+
+def houzz_xml(orders):
+    out = io.StringIO()
+    out.write('<?xml version="1.0" encoding="UTF-8"?><GetOrdersResponse><Ack>Success</Ack><Orders>')
+    for number, lines in orders:
+        out.write(f'<Order><OrderId>{number}</OrderId><OrderItems>')
+        for sku, qty in lines:
+            out.write(f'<OrderItem><SKU>{sku}</SKU><Quantity>{qty}</Quantity></OrderItem>')
+        out.write('</OrderItems></Order>')
+    out.write('</Orders></GetOrdersResponse>')
+    return out.getvalue().encode('utf-8')
+
+
+def faire_orders(orders):
+    return [{'id': f'bo_{number}', 'items': [{'sku': sku, 'quantity': qty} for sku, qty in lines]}
+            for number, lines in orders]
+
+
+def woocommerce_orders(orders):
+    return [{'id': number, 'date_created_gmt': created_at(number).strftime('%Y-%m-%dT%H:%M:%S'),
+             'line_items': [{'sku': sku, 'quantity': qty} for sku, qty in lines]}
+            for number, lines in orders]
+
+
+def dsco_orders(orders):
+    return [{'dscoOrderId': str(number), 'dscoCreateDate': created_at(number).strftime('%Y-%m-%dT%H:%M:%S'),
+             'lineItems': [{'sku': sku, 'quantity': qty} for sku, qty in lines]}
+            for number, lines in orders]
+
+
+def mirakl_orders(orders):
+    return [{'order_id': str(number), 'order_state': 'SHIPPING',
+             'order_lines': [{'offer_sku': sku, 'quantity': qty} for sku, qty in lines]}
+            for number, lines in orders]
+
+
+def wayfair_orders(orders):
+    return [{'poNumber': str(number), 'poDate': created_at(number).strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+             'products': [{'partNumber': sku, 'quantity': qty} for sku, qty in lines]}
+            for number, lines in orders]
+
+
+def write_layout(root, skus, lines, rng):
+    """Create the production directory layout with synthetic maps, stock and export files."""
+    work = os.path.join(root, 'work')
+    for path in ('work/skus', 'sales/tom', 'cloudbbeh/stockfiles', 'cloudbbeh/stock/data', 'cloudbbeh/gonder'):
+        os.makedirs(os.path.join(root, path), exist_ok=True)
+
+    # Every retail SKU is a bundle of one to three components.
+    components = [f'COMP-{i:06d}' for i in range(max(1, len(skus) // 2))]
+    bundle_rows = []
+    for sku in skus:
+        for component in rng.sample(components, min(len(components), rng.randint(1, 3))):
+            bundle_rows.append({'sku_name': component, 'sku_part': sku.lower(), 'multiplier': rng.randint(1, 6)})
+    pd.DataFrame(bundle_rows).to_csv(os.path.join(work, 'skus/skus_map.csv'), index=False)
+
+    pd.DataFrame({'SKU': [sku.lower() for sku in skus],
+                  'cost': [round(rng.uniform(2, 80), 2) for _ in skus],
+                  'brand': [rng.choice(SITES) for _ in skus]}).to_csv(os.path.join(work, 'skus/sales_map.csv'), index=False)
+    pd.DataFrame({'sku': components,
+                  'cost': [round(rng.uniform(1, 40), 2) for _ in components],
+                  'brand': [rng.choice(SITES) for _ in components]}).to_csv(os.path.join(work, 'skus/wholesale_sold_map.csv'), index=False)
+    pd.DataFrame({'sku': components, 'qty': [rng.randint(0, 5000) for _ in components],
+                  'subcategory': 'towels', 'color': 'white', 'brand': [rng.choice(SITES) for _ in components]}
+                 ).to_csv(os.path.join(root, 'cloudbbeh/stockfiles/newstock.csv'), index=False)
+
+    rows = [(sku, qty) for _, order in order_lines(lines, skus, rng) for sku, qty in order]
+    pd.DataFrame(rows, columns=['Item SKU', 'Qty']).to_csv(os.path.join(root, 'sales/tom/tom.csv'), index=False)
+    pd.DataFrame(rows, columns=['sku', 'quantity']).to_csv(os.path.join(root, 'sales/amazon.txt'), sep='\t', index=False)
+    with open(os.path.join(root, 'sales/macys.csv'), 'w') as f:
+        f.write('Macys report\nGenerated by benchmark\nAll stores\nAll dates\n')
+        pd.DataFrame([(sku, qty, 'Macys') for sku, qty in rows], columns=['Vendor SKU', 'Quantity', 'Merchant']).to_csv(f, index=False)
+    try:
+        pd.DataFrame(rows, columns=['SKU', 'Qty']).to_excel(os.path.join(root, 'sales/walmart.xlsx'), index=False)
+    except ImportError:
+        print('No Excel writer installed; skipping the .xlsx export benchmark.')
+    return work
+
+
+# -- local stub API -----------------------------------------------------------
+
+class StubAPI:
+    """Serve synthetic payloads over HTTP with each connector's pagination scheme."""
+
+    def __init__(self, orders, page_size):
+        self.orders = orders
+        self.page_size = page_size
+        self.wayfair = wayfair_orders(orders)
+        self.wayfair_dates = [order['poDate'] for order in self.wayfair]
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def credentials(self):
+        base = self.base_url
+        return {
+            'WALMART': {'credentials': {'user': 'bench', 'pass': 'bench'}, 'correlationID': 'bench',
+                        'walmartServiceName': 'bench', 'clientCredentialEndpoint': f'{base}/walmart/token'},
+            'HOUZZ': {'TOKEN': 'bench', 'USER_NAME': 'bench', 'APP_ID': 'bench', 'BASE_URL': f'{base}/houzz'},
+            'FAIRE': {'API_ACCESS_TOKEN': 'bench', 'ORDERS_ENDPOINT': f'{base}/faire'},
+            'Brand1': {'url': f'{base}/woocommerce', 'credentials': {'user': 'bench', 'pass': 'bench'}},
+            'DSCO': {'BASE_URL': f'{base}/dsco', 'nrdtoken': 'bench'},
+            'THE BAY': {'url': f'{base}/mirakl', 'credentials': {'user': 'bench'}},
+            'WAYFAIR': {'credentials': {'client_id': 'bench', 'client_secret': 'bench', 'audience': 'bench'},
+                        'auth_url': f'{base}/wayfair/token', 'api_url': f'{base}/wayfair'},
+        }
+
+    def page(self, number):
+        start = number * self.page_size
+        return self.orders[start:start + self.page_size]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, body, content_type='application/json', headers=None):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                pages = -(-len(stub.orders) // stub.page_size)
+
+                if url.path == '/walmart/orders':
+                    number = int(query.get('cursor', 0))
+                    next_cursor = f'?cursor={number + 1}' if number + 1 < pages else None
+                    self.send(walmart_page(stub.page(number), next_cursor))
+                elif url.path == '/houzz':
+                    self.send(houzz_xml(stub.orders), 'application/xml')
+                elif url.path == '/faire':
+                    number = int(query.get('page', 1)) - 1
+                    self.send({'page': number + 1, 'orders': faire_orders(stub.page(number))})
+                elif url.path == '/woocommerce':
+                    number = int(query.get('page', 1)) - 1
+                    self.send(woocommerce_orders(stub.page(number)), headers={'X-WP-TotalPages': str(pages)})
+                elif url.path == '/dsco':
+                    number = int(query.get('scrollId', 0))
+                    self.send({'orders': dsco_orders(stub.page(number)), 'scrollId': str(number + 1)})
+                elif url.path == '/mirakl':
+                    offset = int(query.get('offset', 0))
+                    chunk = stub.orders[offset:offset + int(query.get('max', stub.page_size))]
+                    self.send({'orders': mirakl_orders(chunk), 'total_count': len(stub.orders)})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path == '/walmart/token':
+                    self.send(b'<OAuthTokenDTO><accessToken>bench</accessToken><expiresIn>900</expiresIn></OAuthTokenDTO>',
+                              'application/xml')
+                elif self.path == '/wayfair/token':
+                    self.send({'access_token': 'bench', 'expires_in': 3600})
+                elif self.path == '/wayfair':
+                    variables = json.loads(body).get('variables', {})
+                    start = bisect.bisect_left(stub.wayfair_dates, variables.get('fromDate', ''))
+                    chunk = stub.wayfair[start:start + variables.get('limit', stub.page_size)]
+                    self.send({'data': {'getDropshipPurchaseOrders': chunk}})
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+
+# -- measurement --------------------------------------------------------------
+
+def measure(results, scale, name, func, rows_in, trace_memory=True, expect_rows=False):
+    """Time one call of `func` and record rows/sec; then, optionally, its peak traced memory.
+
+    tracemalloc slows allocation-heavy code noticeably, so the peak comes from
+    a second, separate call rather than from the timed one. With `expect_rows`
+    a stage that turns non-empty input into no rows is an error: timing it on
+    nothing would be meaningless.
+    """
+    started = time.perf_counter()
+    value = func()
+    elapsed = time.perf_counter() - started
+
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+
+    frame = value[0] if isinstance(value, tuple) else value
+    if expect_rows and rows_in and (frame is None or len(frame) == 0):
+        raise RuntimeError(f"{name} produced no rows from {rows_in} input rows; the synthetic data is being dropped")
+    results.append({
+        'lines': scale, 'stage': name, 'seconds': round(elapsed, 4), 'rows_in': rows_in,
+        'rows_out': len(frame) if frame is not None else 0,
+        'rows_per_sec': round(rows_in / elapsed) if elapsed else None, 'peak_mb': peak_mb,
+    })
+    print(f"{scale:>9} {name:<34} {elapsed:9.3f}s {results[-1]['rows_per_sec'] or 0:>12,} rows/s "
+          f"{'-' if peak_mb is None else f'{peak_mb:.1f}':>9} MB")
+    return value
+
+
+def bench_scale(etl, lines, args, results):
+    """Benchmark every stage at one scale in a throwaway layout that is removed afterwards."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='etl-bench-') as root:
+        try:
+            bench_layout(etl, lines, args, results, root)
+        finally:
+            # Leave the directory before it is removed.
+            os.chdir(cwd)
+
+
+def bench_layout(etl, lines, args, results, root):
+    rng = random.Random(args.seed)
+    skus = sku_pool(args.skus)
+    orders = list(order_lines(lines, skus, rng))
+    since = ORDER_EPOCH - datetime.timedelta(days=1)
+    until = datetime.datetime.now(datetime.timezone.utc)
+
+    work = write_layout(root, skus, lines, rng)
+    os.chdir(work)
+
+    def timed(name, func, rows, expect_rows=False):
+        return measure(results, lines, name, func, rows, trace_memory=args.memory, expect_rows=expect_rows)
+
+    # Payloads are built before timing starts and dropped right after, so
+    # only one source's payload is held at a time.
+    parsers = [
+        ('process_walmart_data', walmart_page, etl.process_walmart_data),
+        ('parse_xml_to_dataframe (houzz)', houzz_xml, etl.parse_xml_to_dataframe),
+        ('orders_to_dataframe (faire)', lambda o: {'orders': faire_orders(o)}, etl.orders_to_dataframe),
+        ('process_woocommerce_data', woocommerce_orders,
+         lambda payload: etl.process_woocommerce_data(payload, since, until)),
+        ('process_dsco_data', lambda o: {'orders': dsco_orders(o)},
+         lambda payload: etl.process_dsco_data(payload, 'nrdtoken', since, until)),
+        ('process_orders (mirakl)', lambda o: {'orders': mirakl_orders(o)},
+         lambda payload: etl.process_orders(payload, 'THE BAY')),
+        ('process_wayfair_data', lambda o: {'data': {'getDropshipPurchaseOrders': wayfair_orders(o)}},
+         etl.process_wayfair_data),
+    ]
+    frames = []
+    for name, build, process in parsers:
+        payload = build(orders)
+        value = timed(name, lambda: process(payload), lines)
+        frames.append(value[0] if isinstance(value, tuple) else value)
+        del payload
+
+    for name, spec in etl.LOCAL_SOURCES.items():
+        if spec['path'].endswith('.xls'):
+            # Writing legacy .xls needs an engine pandas no longer ships; .xlsx goes through the same reader.
+            spec = dict(spec, path=f"{spec['path']}x")
+        if os.path.exists(spec['path']):
+            frames.append(timed(f'read_source_file ({name})', lambda: etl.read_source_file(spec), lines))
+
+    if args.http:
+        with StubAPI(orders, args.page_size) as stub:
+            etl.get_credentials = stub.credentials
+            etl.WALMART_ORDERS_URL = f'{stub.base_url}/walmart/orders'
+            for name, connector in etl.CONNECTORS.items():
+                # Watermarks are never committed here, so every pass reads the full window.
+                timed(f'{name} fetch+process (stub)', connector, lines)
+            etl.discard_watermarks()
+
+    total = sum(len(frame) for frame in frames)
+    def stream_totals():
+        # A fresh run id per call, so the traced repeat is not rejected as already staged.
+        totals = etl.OrderLineTotals(f'bench-{lines}-{os.urandom(4).hex()}', 'bench')
+        for frame in frames:
+            totals.add(frame)
+        return totals.finish()
+
+    timed('OrderLineTotals (streaming)', stream_totals, total, expect_rows=True)
+    combined = timed('combine_sales', lambda: etl.combine_sales(frames), total, expect_rows=True)
+    deduped = timed('dedupe_order_lines', lambda: etl.dedupe_order_lines(combined, f'bench-{lines}')[0], total,
+                    expect_rows=True)
+    sales = timed('normalize_sales', lambda: etl.normalize_sales(deduped), len(deduped), expect_rows=True)
+    soldvalue = timed('summarize_retail_sales', lambda: etl.summarize_retail_sales(sales), len(sales),
+                      expect_rows=True)
+    final_result = timed('expand_bundles', lambda: etl.expand_bundles(soldvalue), len(soldvalue), expect_rows=True)
+    if not final_result['qty'].any():
+        raise RuntimeError("expand_bundles matched no retail SKU to the bundle map")
+    # A fixed run id makes the traced second call replace the first call's movements.
+    timed('update_stock', lambda: etl.update_stock(final_result, f'bench-{lines}'), len(final_result),
+          expect_rows=True)
+    enriched = timed('enrich_sales', lambda: etl.enrich_sales(sales), len(sales), expect_rows=True)
+    if args.shards > 1:
+        # Normalize through enrich in one go, to compare with the single-process stages above.
+        timed(f'transform_sharded ({args.shards} shards)',
+              lambda: etl.transform_sharded(deduped, args.shards, enrich=True), len(deduped), expect_rows=True)
+    timed('write_brand_outputs', lambda: etl.write_brand_outputs(enriched)[0], len(enriched), expect_rows=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ETL stages on synthetic payloads.')
+    parser.add_argument('--lines', type=int, nargs='+', default=[1000, 100_000], help='Order lines per source')
+    parser.add_argument('--skus', type=int, default=5000, help='Distinct retail SKUs')
+    parser.add_argument('--page-size', type=int, default=200, help='Orders per page served by the stub API')
+    parser.add_argument('--http', action='store_true', help='Also run every connector against the local stub API')
+    parser.add_argument('--shards', type=int, default=4,
+                        help='Processes for the sharded transform stage; 1 skips it (default: %(default)s)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Skip the traced pass that measures peak memory')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', help='Write the results to this file as JSON')
+    args = parser.parse_args(argv)
+
+    etl = load_pipeline()
+    results = []
+    print(f"{'lines':>9} {'stage':<34} {'time':>10} {'throughput':>17} {'peak':>12}")
+    for lines in args.lines:
+        bench_scale(etl, lines, args, results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2894 @@
+import requests
+import io
+import sys
+import json
+import argparse
+import calendar
+import functools
+import importlib.util
+import base64
+import hashlib
+import gzip
+import collections
+import contextlib
+import itertools
+import glob
+import shutil
+import urllib.parse
+import xmltodict
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from pandas.api.extensions import take
+from datetime import datetime, timedelta, timezone
+import xml.etree.ElementTree as ET
+import pytz
+import os
+import sqlite3
+import logging
+import time
+import tracemalloc
+import threading
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import datetime
+
+# Peak RSS comes from getrusage, which only exists on Unix.
+resource = importlib.import_module('resource') if importlib.util.find_spec('resource') else None
+# pyarrow is optional; the Parquet history store needs it.
+pa = importlib.import_module('pyarrow') if importlib.util.find_spec('pyarrow') else None
+pads = importlib.import_module('pyarrow.dataset') if pa is not None else None
+pc = importlib.import_module('pyarrow.compute') if pa is not None else None
+
+
+CREDENTIALS_PATH = './json/projectA-json.json'
+
+
+@functools.lru_cache(maxsize=None)
+def get_credentials():
+    """Load the marketplace credentials on first use."""
+    with open(CREDENTIALS_PATH) as f:
+        return json.load(f)
+
+
+HTTP_TIMEOUT = (10, 120)
+HTTP_POOL_HOSTS = 16
+HTTP_POOL_SIZE = 10
+HTTP_RETRY = Retry(
+    total=5,
+    backoff_factor=1,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(['GET', 'POST']),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the HTTP session shared by every connector.
+
+    One keep-alive connection pool per host, gzip negotiated, and transient
+    failures (connection errors, 429 and 5xx) retried with exponential backoff
+    before the final response is handed back to the caller.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=HTTP_RETRY)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+            _session = session
+    return _session
+
+
+def http_request(method, url, connector=None, **kwargs):
+    """Send a request through the shared session with the default timeout.
+
+    `connector` names the payload for capture and replay; requests made
+    without one (the token calls) are never recorded.
+    """
+    if connector and _capture['mode'] == 'replay':
+        response = replay_response(connector)
+    else:
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+        response = get_session().request(method, url, **kwargs)
+    record_http(response, streamed=kwargs.get('stream', False))
+    if connector and _capture['mode'] == 'capture':
+        capture_response(connector, response)
+    return response
+
+
+CAPTURE_DIR = './captures'
+CAPTURED_HEADERS = ('Content-Type', 'X-WP-Total', 'X-WP-TotalPages')
+
+_capture = {'mode': None, 'run_id': None, 'queues': None}
+_capture_lock = threading.Lock()
+
+
+def configure_capture(mode, run_id):
+    """Record connector payloads under `run_id` ('capture'), feed them back ('replay'), or neither (None)."""
+    with _capture_lock:
+        _capture.update(mode=mode, run_id=run_id, queues=None)
+    if mode == 'replay':
+        manifest = os.path.join(CAPTURE_DIR, 'runs', f'{run_id}.jsonl')
+        if not os.path.exists(manifest):
+            raise FileNotFoundError(f"No captured run {run_id} in {CAPTURE_DIR}")
+        queues = collections.defaultdict(collections.deque)
+        with open(manifest) as f:
+            for line in f:
+                entry = json.loads(line)
+                queues[entry['connector']].append(entry)
+        _capture['queues'] = queues
+
+
+def _object_path(digest):
+    return os.path.join(CAPTURE_DIR, 'objects', digest[:2], f'{digest}.gz')
+
+
+def capture_response(connector, response):
+    """Store a response body compressed and content-addressed, and log it in the run manifest.
+
+    Streamed bodies are read in full and swapped for an in-memory copy so the
+    caller can still consume response.raw.
+    """
+    content = response.content
+    response.raw = io.BytesIO(content)
+
+    digest = hashlib.sha256(content).hexdigest()
+    path = _object_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(f'{path}.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(f'{path}.tmp', path)
+
+    entry = {
+        'connector': connector,
+        'status_code': response.status_code,
+        'headers': {name: response.headers[name] for name in CAPTURED_HEADERS if name in response.headers},
+        'object': digest,
+    }
+    manifest = os.path.join(CAPTURE_DIR, 'runs', f"{_capture['run_id']}.jsonl")
+    with _capture_lock:
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+        with open(manifest, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+class ReplayResponse:
+    """The parts of requests.Response the fetchers use, rebuilt from a captured payload."""
+
+    def __init__(self, entry):
+        with gzip.open(_object_path(entry['object']), 'rb') as f:
+            self.content = f.read()
+        self.status_code = entry['status_code']
+        self.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        self.raw = io.BytesIO(self.content)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+
+def replay_response(connector):
+    """Return the next captured response for `connector`, in the order it was recorded."""
+    with _capture_lock:
+        captured = _capture['queues'].get(connector)
+        if not captured:
+            raise LookupError(f"Replay of {_capture['run_id']} has no more captured responses for {connector}")
+        entry = captured.popleft()
+    return ReplayResponse(entry)
+
+
+REPORT_DIR = './reports'
+METRICS_TEXTFILE = os.path.join(REPORT_DIR, 'portfolio_etl.prom')
+METRIC_PREFIX = 'portfolio_etl'
+
+_report = {'run_id': None, 'started': None, 'spans': []}
+_report_lock = threading.Lock()
+_active = threading.local()
+
+
+def peak_rss_bytes():
+    """Return the process's peak resident set size so far, or None where getrusage is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def begin_run_report(run_id):
+    """Start collecting spans for a new run, dropping those of any previous one."""
+    with _report_lock:
+        _report.update(run_id=run_id, started=datetime.datetime.now(), spans=[])
+
+
+def current_span():
+    """Return the record of the span active on this thread, if any."""
+    return getattr(_active, 'span', None)
+
+
+def record_span(record):
+    with _report_lock:
+        _report['spans'].append(record)
+
+
+@contextlib.contextmanager
+def span(stage, name=None, rows_in=None):
+    """Time one pipeline step and add it to the run report.
+
+    Yields the step's record for it to fill in 'rows_out' and anything else
+    worth reporting. HTTP requests made while the span is active, on this
+    thread or on a prefetch thread it started, are counted into it.
+    """
+    record = {'stage': stage, 'name': name, 'rows_in': rows_in, 'rows_out': None, 'status': 'ok',
+              'http': {'requests': 0, 'bytes': 0, 'retries': 0, 'statuses': {}}}
+    parent = current_span()
+    _active.span = record
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        record['status'] = 'error'
+        raise
+    finally:
+        _active.span = parent
+        record['seconds'] = round(time.perf_counter() - started, 4)
+        record['peak_rss_bytes'] = peak_rss_bytes()
+        record_span(record)
+
+
+def add_to_span(**values):
+    """Accumulate numeric counters on the active span."""
+    record = current_span()
+    if record is None:
+        return
+    with _report_lock:
+        for key, value in values.items():
+            record[key] = record.get(key, 0) + value
+
+
+def record_http(response, streamed=False):
+    """Count a response's size, status and urllib3 retries against the active span.
+
+    Streamed bodies have not been read yet (and chunked ones have no
+    Content-Length), so their bytes are counted by CountingReader as the
+    caller reads them.
+    """
+    record = current_span()
+    if record is None:
+        return
+    size = 0 if streamed else len(response.content)
+    retries = getattr(response.raw, 'retries', None)
+    status = str(response.status_code)
+    with _report_lock:
+        http = record['http']
+        http['requests'] += 1
+        http['bytes'] += size
+        http['retries'] += len(retries.history) if retries is not None else 0
+        http['statuses'][status] = http['statuses'].get(status, 0) + 1
+
+
+class CountingReader:
+    """Wrap a streamed response body so the bytes read from it count against a span."""
+
+    def __init__(self, raw, record):
+        self._raw = raw
+        self._record = record
+
+    def read(self, size=-1):
+        data = self._raw.read(size)
+        with _report_lock:
+            self._record['http']['bytes'] += len(data)
+        return data
+
+
+def counted_body(raw):
+    """Return `raw` wrapped so reading it counts into the active span, if there is one."""
+    record = current_span()
+    return raw if record is None else CountingReader(raw, record)
+
+
+def _write_atomically(path, text):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(text)
+    os.replace(f'{path}.tmp', path)
+
+
+def _metric_labels(labels):
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for key, value in labels.items()}
+    return ','.join(f'{key}="{value}"' for key, value in escaped.items())
+
+
+def format_metrics(report):
+    """Render a run report in the Prometheus text exposition format."""
+    # A step that ran twice keeps its last record, except that a timeout is never
+    # overwritten by the late span of the connector run_connectors gave up on.
+    spans = {}
+    for record in report['spans']:
+        key = (record['stage'], record['name'] or '')
+        if spans.get(key, {}).get('status') != 'timeout':
+            spans[key] = record
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_{name} gauge')
+        for labels, value in samples:
+            if value is not None:
+                series = f'{METRIC_PREFIX}_{name}{{{_metric_labels(labels)}}}' if labels else f'{METRIC_PREFIX}_{name}'
+                lines.append(f'{series} {value}')
+
+    def per_span(get, only=lambda record: True):
+        return [({'stage': stage, 'name': name}, get(record)) for (stage, name), record in spans.items() if only(record)]
+
+    fetched = lambda record: record.get('http', {}).get('requests')
+    metric('stage_duration_seconds', 'Wall time of the step.', per_span(lambda r: r.get('seconds')))
+    metric('stage_rows_in', 'Rows handed to the step.', per_span(lambda r: r.get('rows_in')))
+    metric('stage_rows_out', 'Rows produced by the step.', per_span(lambda r: r.get('rows_out')))
+    metric('stage_success', '1 if the step finished, 0 if it failed or timed out.',
+           per_span(lambda r: int(r['status'] == 'ok')))
+    metric('stage_peak_rss_bytes', 'Process peak RSS when the step ended.', per_span(lambda r: r.get('peak_rss_bytes')))
+    metric('stage_fetch_seconds', 'Time spent waiting for pages.', per_span(lambda r: r.get('fetch_seconds')))
+    metric('stage_parse_seconds', 'Time spent processing fetched pages.', per_span(lambda r: r.get('parse_seconds')))
+    metric('http_requests', 'HTTP requests made by the step.', per_span(lambda r: r['http']['requests'], fetched))
+    metric('http_bytes', 'Response bytes fetched by the step.', per_span(lambda r: r['http']['bytes'], fetched))
+    metric('http_retries', 'Retries urllib3 made before the final responses.',
+           per_span(lambda r: r['http']['retries'], fetched))
+    metric('http_responses', 'Final HTTP responses by status code.', [
+        ({'stage': stage, 'name': name, 'code': code}, count)
+        for (stage, name), record in spans.items() if fetched(record)
+        for code, count in record['http']['statuses'].items()
+    ])
+    metric('run_duration_seconds', 'Wall time of the whole run.', [({}, report['seconds'])])
+    metric('run_peak_rss_bytes', 'Process peak RSS over the run.', [({}, report['peak_rss_bytes'])])
+    metric('run_success', '1 if the run finished without an exception.', [({}, int(report['status'] == 'ok'))])
+    metric('run_last_completion_timestamp_seconds', 'Unix time the run ended.', [({}, round(time.time()))])
+    return '\n'.join(lines) + '\n'
+
+
+def write_run_report(status, report_dir=REPORT_DIR, textfile=METRICS_TEXTFILE):
+    """Write the collected spans as a JSON run report and a Prometheus textfile.
+
+    The textfile is replaced atomically so a node_exporter textfile collector
+    never reads it half-written. Returns the JSON report's path.
+    """
+    with _report_lock:
+        report = {
+            'run_id': _report['run_id'],
+            'status': status,
+            'started': _report['started'].isoformat(timespec='seconds'),
+            'seconds': round((datetime.datetime.now() - _report['started']).total_seconds(), 4),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'spans': list(_report['spans']),
+        }
+    path = os.path.join(report_dir, 'runs', f"{report['run_id']}-{_report['started']:%H%M%S}.json")
+    _write_atomically(path, json.dumps(report, indent=2, default=str))
+    if textfile:
+        _write_atomically(textfile, format_metrics(report))
+    return path
+
+
+PREFETCH_DEPTH = 2
+
+
+def prefetch(pages, depth=PREFETCH_DEPTH):
+    """Iterate a page generator from a background thread.
+
+    Up to `depth` pages are fetched ahead, so the caller can process one page
+    while the request for the next one is already in flight.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    finished = object()
+    owner = current_span()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        _active.span = owner
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(finished)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class FetchFailed(Exception):
+    """A page request failed part-way through a window."""
+
+
+def collect_pages(pages, process):
+    """Process fetched pages as they arrive and gather the results.
+
+    `pages` yields (payload, status_code) and signals a failed request with a
+    None payload. Returns (frame, status_code), with frame None on failure so
+    a partially fetched window is never passed downstream. Pages are gathered
+    by gather_order_lines, so in streaming mode only running totals are kept.
+    Time spent waiting for pages and processing them is added to the active
+    span.
+    """
+    status_code = None
+    timings = {'pages': 0, 'fetch_seconds': 0.0, 'parse_seconds': 0.0}
+
+    def processed():
+        nonlocal status_code
+        mark = time.perf_counter()
+        for page, status_code in prefetch(pages):
+            fetched = time.perf_counter()
+            timings['fetch_seconds'] += fetched - mark
+            if page is None:
+                raise FetchFailed(status_code)
+            yield process(page)
+            mark = time.perf_counter()
+            timings['parse_seconds'] += mark - fetched
+            timings['pages'] += 1
+
+    try:
+        return gather_order_lines(processed()), status_code
+    except FetchFailed:
+        return None, status_code
+    finally:
+        add_to_span(**timings)
+
+
+STATE_DB = './state/etl.sqlite'
+WATERMARK_LOOKBACK = timedelta(days=7)
+
+_pending_watermarks = {}
+_watermark_lock = threading.Lock()
+_connector_marks = threading.local()
+
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    connector TEXT PRIMARY KEY,
+    high_water TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stock_movements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    qty REAL NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stock_movements_run ON stock_movements (run_id, sku);
+CREATE TABLE IF NOT EXISTS stock_current (
+    sku TEXT PRIMARY KEY,
+    qty REAL,
+    subcategory TEXT,
+    color TEXT,
+    brand TEXT
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS seen_lines (
+    line_key TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    seen_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_lines_run ON seen_lines (run_id);
+CREATE TABLE IF NOT EXISTS pending_lines (
+    run_id TEXT NOT NULL,
+    line_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    stream_id TEXT NOT NULL,
+    PRIMARY KEY (run_id, line_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sales_rollups (
+    grain TEXT NOT NULL,
+    period TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    site TEXT NOT NULL,
+    qty REAL NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (grain, period, sku, brand, site)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_contributions (
+    run_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    site TEXT NOT NULL,
+    qty REAL NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (run_id, day, sku, brand, site)
+) WITHOUT ROWID;
+"""
+
+
+def state_db():
+    """Open the local SQLite database holding the pipeline's run state."""
+    os.makedirs(os.path.dirname(STATE_DB), exist_ok=True)
+    conn = sqlite3.connect(STATE_DB, timeout=30)
+    conn.executescript(STATE_SCHEMA)
+    return conn
+
+
+def watermark_now():
+    """The current time as a watermark: UTC and in whole seconds, as the APIs are sent it."""
+    return datetime.datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def get_watermark(connector):
+    """Return the last committed high-water mark for a connector, in UTC.
+
+    Connectors that have never completed a run start WATERMARK_LOOKBACK back.
+    """
+    conn = state_db()
+    try:
+        row = conn.execute('SELECT high_water FROM watermarks WHERE connector = ?', (connector,)).fetchone()
+    finally:
+        conn.close()
+    if row:
+        # Marks committed before watermarks were kept in UTC are naive local times.
+        return datetime.datetime.fromisoformat(row[0]).astimezone(timezone.utc)
+    return watermark_now() - WATERMARK_LOOKBACK
+
+
+def stage_watermark(connector, high_water):
+    """Remember a connector's new high-water mark until the run is committed.
+
+    Inside run_connectors the mark is held back with the connector's result,
+    so a connector that outlives its timeout never advances its watermark.
+    """
+    marks = getattr(_connector_marks, 'marks', None)
+    if marks is not None:
+        marks[connector] = high_water
+        return
+    with _watermark_lock:
+        _pending_watermarks[connector] = high_water
+
+
+def commit_watermarks():
+    """Persist the staged high-water marks once the run's outputs are written."""
+    with _watermark_lock:
+        pending = dict(_pending_watermarks)
+        _pending_watermarks.clear()
+    if not pending:
+        return
+    updated_at = datetime.datetime.now().isoformat()
+    conn = state_db()
+    try:
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO watermarks (connector, high_water, updated_at) VALUES (?, ?, ?)',
+                [(connector, high_water.isoformat(), updated_at) for connector, high_water in pending.items()],
+            )
+    finally:
+        conn.close()
+
+
+TOKEN_CACHE_PATH = './state/tokens.json'
+TOKEN_REFRESH_MARGIN = 120
+DEFAULT_TOKEN_LIFETIME = 900
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+_token_locks = {}
+
+
+def _load_token_cache():
+    """Read unexpired tokens from TOKEN_CACHE_PATH."""
+    try:
+        with open(TOKEN_CACHE_PATH) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {key: entry for key, entry in entries.items() if entry.get('expires_at', 0) > now}
+
+
+def _save_token_cache(entries):
+    """Atomically write the token cache, readable by the owner only."""
+    os.makedirs(os.path.dirname(TOKEN_CACHE_PATH), exist_ok=True)
+    tmp_path = f'{TOKEN_CACHE_PATH}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(entries, f)
+    os.replace(tmp_path, TOKEN_CACHE_PATH)
+
+
+def cached_token(connector, credentials, request_token):
+    """Return an access token for `connector`, requesting a new one only when needed.
+
+    Tokens are cached in memory and on disk, keyed by connector and a hash of
+    the credentials, and refreshed TOKEN_REFRESH_MARGIN seconds before they
+    expire. `request_token` performs the client-credentials call and returns
+    (token, expires_in, status_code). Returns (token, status_code), with a
+    status of 'cached' when no request was made.
+    """
+    global _token_cache
+    if _capture['mode'] == 'replay':
+        return 'replay', 'replay'
+
+    digest = hashlib.sha256(json.dumps(credentials, sort_keys=True).encode()).hexdigest()[:16]
+    key = f'{connector}:{digest}'
+
+    with _token_cache_lock:
+        if _token_cache is None:
+            _token_cache = _load_token_cache()
+        key_lock = _token_locks.setdefault(key, threading.Lock())
+
+    # One refresh per key at a time; other connectors' tokens are not held up.
+    with key_lock:
+        entry = _token_cache.get(key)
+        if entry and entry['expires_at'] - TOKEN_REFRESH_MARGIN > time.time():
+            return entry['token'], 'cached'
+
+        token, expires_in, status_code = request_token()
+        if token:
+            with _token_cache_lock:
+                _token_cache[key] = {'token': token, 'expires_at': time.time() + int(expires_in or DEFAULT_TOKEN_LIFETIME)}
+                _save_token_cache(_token_cache)
+        return token, status_code
+
+
+def get_walmart_token():
+    """Retrieve the access token for Walmart API."""
+    json_credentials = get_credentials()
+    credentials = json_credentials['WALMART']['credentials']
+
+    def request_token():
+        encoded_credentials = base64.b64encode(f"{credentials['user']}:{credentials['pass']}".encode()).decode()
+        headers = {
+            "Authorization": f"Basic {encoded_credentials}",
+            "WM_QOS.CORRELATION_ID": json_credentials['WALMART']['correlationID'],
+            "WM_SVC.NAME": json_credentials['WALMART']['walmartServiceName'],
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        response = http_request('POST', json_credentials['WALMART']['clientCredentialEndpoint'],
+                                data={"grant_type": "client_credentials"},
+                                headers=headers)
+        if response.status_code == 200:
+            token_data = xmltodict.parse(response.content)['OAuthTokenDTO']
+            return token_data['accessToken'], token_data.get('expiresIn'), response.status_code
+        else:
+            raise Exception(f"Error obtaining Walmart token: {response.status_code} {response.text}")
+
+    access_token, _ = cached_token('walmart', credentials, request_token)
+    return access_token
+
+WALMART_ORDERS_URL = "https://marketplace.walmartapis.com/v3/orders"
+WALMART_PAGE_SIZE = 200
+
+
+def fetch_walmart_data(token, since):
+    """Yield (page, status_code) for orders created after `since` from Walmart API, following nextCursor."""
+    json_credentials = get_credentials()
+    date_from = since.strftime('%Y-%m-%dT%H:%M:%SZ')
+    endpoint = f"{WALMART_ORDERS_URL}?createdStartDate={date_from}&limit={WALMART_PAGE_SIZE}"
+    headers = {
+        "WM_SEC.ACCESS_TOKEN": token,
+        "WM_QOS.CORRELATION_ID": json_credentials['WALMART']['correlationID'],
+        "WM_SVC.NAME": json_credentials['WALMART']['walmartServiceName'],
+        "accept": "application/json"
+    }
+    while endpoint:
+        response = http_request('GET', endpoint, connector='walmart', headers=headers)
+        if response.status_code != 200:
+            yield None, response.status_code
+            return
+        page = response.json()
+        yield page, response.status_code
+
+        next_cursor = page.get('list', {}).get('meta', {}).get('nextCursor')
+        endpoint = f"{WALMART_ORDERS_URL}{next_cursor}" if next_cursor else None
+
+
+ORDER_LINE_COLUMNS = ['sku', 'qty', 'site']
+QTY_DTYPE = 'int32'
+# Optional column identifying each line as source|order id|line number.
+LINE_KEY = 'line_key'
+
+
+def order_line_key(source, order_id, line_no):
+    """Build a line's identity key, or None when the order id is unknown."""
+    if order_id is None or pd.isna(order_id):
+        return None
+    return f'{source}|{order_id}|{line_no}'
+
+
+def empty_order_lines():
+    """Return an empty frame in the canonical order-line schema."""
+    return pd.DataFrame({
+        'sku': pd.Categorical([]),
+        'qty': np.array([], dtype=QTY_DTYPE),
+        'site': pd.Categorical([]),
+    })
+
+
+def is_order_lines(frame):
+    """Tell whether a frame is already in the canonical order-line schema."""
+    return (
+        list(frame.columns) in (ORDER_LINE_COLUMNS, ORDER_LINE_COLUMNS + [LINE_KEY])
+        and isinstance(frame['sku'].dtype, pd.CategoricalDtype)
+        and frame['qty'].dtype == QTY_DTYPE
+        and isinstance(frame['site'].dtype, pd.CategoricalDtype)
+    )
+
+
+def to_order_lines(frame, site=None):
+    """Validate a source's sku/qty(/site) frame and cast it to the canonical order-line schema.
+
+    Every source emits `sku` and `site` as categoricals (each distinct string
+    stored once) and `qty` as int32. Lines without a SKU or with a
+    non-numeric quantity are dropped here, at the source. `site` labels the
+    lines when the frame has no site column of its own. A `line_key` column,
+    when the source provides one, is carried along as plain strings.
+    """
+    if frame is None or len(frame) == 0:
+        return empty_order_lines()
+    if is_order_lines(frame):
+        return frame
+
+    qty = pd.to_numeric(frame['qty'], errors='coerce')
+    valid = (frame['sku'].notna() & qty.notna()).to_numpy()
+    sku = frame['sku'].to_numpy()[valid]
+    count = int(valid.sum())
+
+    if 'site' in frame:
+        sites = pd.Categorical(frame['site'].astype(str).to_numpy()[valid])
+    else:
+        sites = pd.Categorical.from_codes(np.zeros(count, dtype='int8'), [site])
+
+    lines = pd.DataFrame({
+        'sku': pd.Categorical(pd.Series(sku, dtype=object).astype(str).str.strip()),
+        'qty': qty.to_numpy()[valid].astype(QTY_DTYPE),
+        'site': sites,
+    })
+    if LINE_KEY in frame:
+        lines[LINE_KEY] = frame[LINE_KEY].to_numpy(dtype=object)[valid]
+    return lines
+
+
+def concat_order_lines(frames):
+    """Concatenate order-line frames, keeping `sku` and `site` categorical.
+
+    If any frame has line keys the result has them too, missing for the lines
+    of frames without.
+    """
+    frames = [to_order_lines(frame) for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return empty_order_lines()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    lines = pd.DataFrame({
+        'sku': union_categoricals([frame['sku'] for frame in frames], ignore_order=True),
+        'qty': np.concatenate([frame['qty'].to_numpy() for frame in frames]),
+        'site': union_categoricals([frame['site'] for frame in frames], ignore_order=True),
+    })
+    if any(LINE_KEY in frame for frame in frames):
+        lines[LINE_KEY] = np.concatenate([
+            frame[LINE_KEY].to_numpy(dtype=object) if LINE_KEY in frame else np.full(len(frame), None, dtype=object)
+            for frame in frames
+        ])
+    return lines
+
+
+def dig(obj, path):
+    """Follow a tuple of keys into nested dicts, returning None where the path breaks."""
+    for key in path:
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def flatten_order_lines(orders, line_path, fields, site, key=None):
+    """Flatten nested order -> line records into a sku/qty/site frame in one pass.
+
+    `line_path` leads from an order to its list of lines and `fields` maps the
+    'sku' and 'qty' columns to key paths inside a line. Columns are built as
+    plain lists and turned into a frame once, so cost is linear in line count.
+    `key` is (source, order id path, line number path) and adds line keys;
+    lines without a number of their own are numbered by position.
+    """
+    columns = {name: [] for name in fields}
+    keys = []
+    for order in orders or []:
+        lines = dig(order, line_path) or []
+        if isinstance(lines, dict):
+            lines = [lines]
+        order_id = dig(order, key[1]) if key else None
+        for position, line in enumerate(lines, 1):
+            for name, path in fields.items():
+                columns[name].append(dig(line, path))
+            if key:
+                line_no = dig(line, key[2])
+                keys.append(order_line_key(key[0], order_id, position if line_no is None else line_no))
+
+    frame = pd.DataFrame(columns, columns=['sku', 'qty'])
+    if key:
+        frame[LINE_KEY] = keys
+    return to_order_lines(frame, site=site)
+
+
+def process_walmart_data(data):
+    """Process and format the Walmart order data."""
+    orders = dig(data, ('list', 'elements', 'order'))
+    return flatten_order_lines(
+        orders,
+        ('orderLines', 'orderLine'),
+        {'sku': ('item', 'sku'), 'qty': ('orderLineQuantity', 'amount')},
+        'walmart',
+        key=('walmart', ('purchaseOrderId',), ('lineNumber',)),
+    )
+
+def walmart_main():
+    try:
+        token = get_walmart_token()
+        until = watermark_now()
+        formatted_data, status_code = collect_pages(fetch_walmart_data(token, get_watermark('walmart')), process_walmart_data)
+
+        if formatted_data is not None:
+            total_orders = len(formatted_data)
+            stage_watermark('walmart', until)
+        else:
+            print(f"Error fetching Walmart data. Status Code: {status_code}")
+            formatted_data = empty_order_lines()
+            total_orders = 0
+
+        return formatted_data, total_orders, status_code
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return empty_order_lines(), 0, None  
+
+def fetch_houzz_data(since, until):
+    """Fetch orders placed between `since` and `until` from Houzz API."""
+    houzz_credentials = get_credentials()['HOUZZ']
+    start_date_str = since.strftime("%Y-%m-%d %H:%M:%S+00:00")
+    end_date_str = until.strftime("%Y-%m-%d %H:%M:%S+00:00")
+    
+    params = {
+        "format": "xml",
+        "method": "getOrders",
+        "From": start_date_str,
+        "To": end_date_str
+    }
+    
+    headers = {
+        "X-HOUZZ-API-SSL-TOKEN": houzz_credentials['TOKEN'],
+        "X-HOUZZ-API-USER-NAME": houzz_credentials['USER_NAME'],
+        "X-HOUZZ-API-APP-NAME": houzz_credentials['APP_ID']
+    }
+
+    response = http_request('GET', houzz_credentials['BASE_URL'], connector='houzz',
+                            headers=headers, params=params, stream=True)
+    if response.status_code != 200:
+        response.close()
+        return None, response.status_code
+
+    # Hand back the undecoded body stream so the parser can read it incrementally.
+    response.raw.decode_content = True
+    return counted_body(response.raw), response.status_code
+
+
+HOUZZ_BATCH_SIZE = 5000
+
+
+def iter_houzz_batches(source, batch_size=HOUZZ_BATCH_SIZE):
+    """Stream a Houzz getOrders response into sku/qty/site frames of about `batch_size` lines.
+
+    `source` is a file-like object or the XML text. Each Order is detached from
+    the tree once it has been read, so memory stays flat however many orders
+    the response holds. Lines are keyed by their Order's OrderId and their
+    position within it.
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    skus, qtys, keys = [], [], []
+    stack = []
+    sku = qty = order_id = None
+
+    def batch():
+        keys.extend([None] * (len(skus) - len(keys)))
+        return to_order_lines(pd.DataFrame({'sku': skus, 'qty': qtys, LINE_KEY: keys}), site='Houzz')
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'OrderItem':
+                sku = qty = None
+            elif elem.tag == 'Order':
+                order_id = None
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is not None and parent.tag == 'OrderItem':
+            if elem.tag == 'SKU':
+                sku = elem.text
+            elif elem.tag == 'Quantity':
+                qty = int(elem.text)
+        elif elem.tag == 'OrderItem':
+            skus.append(sku)
+            qtys.append(qty)
+        elif elem.tag == 'OrderId' and parent is not None and parent.tag == 'Order':
+            order_id = elem.text
+        elif elem.tag == 'Order':
+            # Items read since the last Order ended belong to this one.
+            keys.extend(order_line_key('houzz', order_id, position)
+                        for position in range(1, len(skus) - len(keys) + 1))
+            if parent is not None:
+                parent.remove(elem)
+            elem.clear()
+            if len(skus) >= batch_size:
+                yield batch()
+                skus, qtys, keys = [], [], []
+
+    if skus:
+        yield batch()
+
+
+def parse_xml_to_dataframe(xml_source):
+    """Parse XML response to DataFrame."""
+    return gather_order_lines(iter_houzz_batches(xml_source))
+
+def houzz_main():
+    try:
+        until = watermark_now()
+        xml_data, status_code = fetch_houzz_data(get_watermark('houzz'), until)
+        if xml_data is not None:
+            houzz_orders = parse_xml_to_dataframe(xml_data)
+            total_orders = len(houzz_orders)
+            stage_watermark('houzz', until)
+        else:
+            houzz_orders = empty_order_lines()
+            total_orders = 0
+        return houzz_orders, total_orders, status_code
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return empty_order_lines(), 0, None
+
+
+FAIRE_PAGE_SIZE = 50
+
+
+def fetch_orders(since):
+    """Yield (page, status_code) for orders created after `since` from Faire API, one page at a time."""
+    faire_credentials = get_credentials()['FAIRE']
+    headers = {"X-FAIRE-ACCESS-TOKEN": faire_credentials['API_ACCESS_TOKEN']}
+
+    since_iso = since.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    page_number = 1
+    while True:
+        params = {'created_at_min': since_iso, 'limit': FAIRE_PAGE_SIZE, 'page': page_number}
+        response = http_request('GET', faire_credentials['ORDERS_ENDPOINT'], connector='faire',
+                                headers=headers, params=params)
+        if not 200 <= response.status_code <= 299:
+            yield None, response.status_code
+            return
+        page = response.json()
+        yield page, response.status_code
+
+        if len(page.get('orders', [])) < FAIRE_PAGE_SIZE:
+            return
+        page_number += 1
+
+
+def orders_to_dataframe(orders_data):
+    """Convert fetched orders to DataFrame."""
+    orders = orders_data.get('orders') if orders_data else None
+    return flatten_order_lines(orders, ('items',), {'sku': ('sku',), 'qty': ('quantity',)}, 'Faire',
+                               key=('faire', ('id',), ('id',)))
+
+
+def faire_main():
+    until = watermark_now()
+    faire_orders, status_code = collect_pages(fetch_orders(get_watermark('faire')), orders_to_dataframe)
+    if faire_orders is not None:
+        total_orders = len(faire_orders)
+        stage_watermark('faire', until)
+    else:
+        print(f"Error fetching Faire data. Status Code: {status_code}")
+        faire_orders = empty_order_lines()
+        total_orders = 0
+    return faire_orders, total_orders, status_code
+
+
+WOOCOMMERCE_PAGE_SIZE = 100
+WOOCOMMERCE_FIELDS = 'id,date_created_gmt,line_items.id,line_items.sku,line_items.quantity'
+
+
+def fetch_woocommerce_data(since, until):
+    """Yield (page, status_code) for Brand1 WooCommerce orders created between `since` and `until`.
+
+    Dates are filtered server-side with after/before, only the fields the
+    pipeline reads are requested, and pages are walked via X-WP-TotalPages.
+    """
+    brand1_credentials = get_credentials()["Brand1"]
+    auth = (brand1_credentials["credentials"]["user"], brand1_credentials["credentials"]["pass"])
+
+    page_number = 1
+    while True:
+        params = {
+            'after': since.strftime('%Y-%m-%dT%H:%M:%S'),
+            'before': until.strftime('%Y-%m-%dT%H:%M:%S'),
+            'dates_are_gmt': 'true',
+            'per_page': WOOCOMMERCE_PAGE_SIZE,
+            'page': page_number,
+            '_fields': WOOCOMMERCE_FIELDS,
+        }
+        response = http_request('GET', brand1_credentials["url"], connector='brand1', auth=auth, params=params)
+        if response.status_code != 200:
+            yield None, response.status_code
+            return
+        yield response.json(), response.status_code
+
+        total_pages = int(response.headers.get('X-WP-TotalPages', page_number))
+        if page_number >= total_pages:
+            return
+        page_number += 1
+
+def process_woocommerce_data(output, since, until):
+    """Convert a page of WooCommerce orders to DataFrame."""
+    created = pd.to_datetime(pd.Series([order.get('date_created_gmt') for order in output], dtype=object),
+                             errors='coerce', utc=True)
+    # Inclusive lower bound, as for DSCO: line keys drop orders seen on both sides of a watermark.
+    in_window = ((created >= since) & (created < until)).tolist()
+    orders = [order for order, keep in zip(output, in_window) if keep]
+    return flatten_order_lines(orders, ('line_items',), {'sku': ('sku',), 'qty': ('quantity',)}, 'Brand1',
+                               key=('brand1', ('id',), ('id',)))
+
+def brand1_main():
+    until = watermark_now()
+    since = get_watermark('brand1')
+    brand1_orders, status_code = collect_pages(
+        fetch_woocommerce_data(since, until),
+        lambda output: process_woocommerce_data(output, since, until),
+    )
+    if brand1_orders is not None:
+        total_orders = len(brand1_orders)
+        stage_watermark('brand1', until)
+    else:
+        print(f"Error fetching Brand1 data. Status Code: {status_code}")
+        brand1_orders = empty_order_lines()
+        total_orders = 0
+    return brand1_orders, total_orders, status_code
+
+
+DSCO_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def fetch_dsco_data(token, start_date_str, current_datetime, connector='dsco'):
+    """Yield (page, status_code) for orders from DSCO API, following the scrollId until a page comes back empty."""
+    json_credentials = get_credentials()
+    headers = {"Authorization": "Bearer " + token, "Content-Type": "application/json", "Accept": "application/json"}
+    params = {'ordersCreatedSince': start_date_str, 'until': current_datetime.strftime(DSCO_TIME_FORMAT)}
+    while True:
+        response = http_request('GET', json_credentials['DSCO']['BASE_URL'], connector=connector,
+                                params=params, headers=headers)
+        if response.status_code != 200:
+            yield None, response.status_code
+            return
+        page = response.json()
+        yield page, response.status_code
+
+        scroll_id = page.get('scrollId')
+        if not scroll_id or not page.get('orders'):
+            return
+        params = {'scrollId': scroll_id}
+
+
+def process_dsco_data(orders, api_name, start_date, current_datetime):
+    """Convert fetched orders to DataFrame."""
+    try:
+        df = pd.json_normalize(orders, 'orders')
+        
+        if not df.empty:
+            df['dscoCreateDate'] = pd.to_datetime(df.get('dscoCreateDate'), errors='coerce', utc=True)
+
+            # Line keys drop orders seen on both sides of a watermark, so the lower bound is inclusive.
+            df = df[(df['dscoCreateDate'] >= start_date) & (df['dscoCreateDate'] < current_datetime)]
+            
+            df = df.explode('lineItems')
+            line_numbers = df.groupby(level=0).cumcount().to_numpy() + 1
+            order_ids = df['dscoOrderId'].to_numpy() if 'dscoOrderId' in df else [None] * len(df)
+            df = pd.json_normalize(df['lineItems'])
+
+            site = {
+                'nrdtoken': 'Nordstrom',
+                'softoken': 'Saks OF 5th',
+                'aafestoken': 'Aafes',
+                'brandxtoken': 'Bonton',
+                'lordtoken': 'Lord & Taylor'
+            }[api_name]
+            df = df.rename({'sku': 'sku', 'quantity': 'qty'}, axis=1)
+            df[LINE_KEY] = [order_line_key('dsco', order_id, line_no) for order_id, line_no in zip(order_ids, line_numbers)]
+            return to_order_lines(df[['sku', 'qty', LINE_KEY]], site=site)
+
+        return empty_order_lines()
+    except KeyError:
+        print(f"KeyError encountered for {api_name}. Please check the JSON structure.")
+        return empty_order_lines()
+
+
+def dsco_main():
+    json_credentials = get_credentials()
+    # The watermark staged below is exactly the `until` sent to the API.
+    current_datetime = watermark_now()
+
+    dscosales = []
+    total_orders = 0
+    status_summary = {}
+
+    
+    api_tokens = {k: v for k, v in json_credentials['DSCO'].items() if k != 'BASE_URL'}
+
+    for api_name, token in api_tokens.items():
+        start_date = get_watermark(f'dsco:{api_name}')
+        start_date_str = start_date.strftime(DSCO_TIME_FORMAT)
+        sales_data, status_code = collect_pages(
+            fetch_dsco_data(token, start_date_str, current_datetime, connector=f'dsco:{api_name}'),
+            lambda orders: process_dsco_data(orders, api_name, start_date, current_datetime),
+        )
+        status_summary[api_name] = status_code
+
+        if sales_data is not None:
+            dscosales.append(sales_data)
+            total_orders += len(sales_data)
+            stage_watermark(f'dsco:{api_name}', current_datetime)
+        else:
+            print(f"Error fetching data for {api_name}. Status Code: {status_code}")
+
+    return concat_order_lines(dscosales), total_orders, status_summary
+
+
+
+MIRAKL_PAGE_SIZE = 100
+
+
+def fetch_mirakl_data(api_info, start_date_str, end_date_str, connector='mirakl'):
+    """Yield (page, status_code) for orders from Mirakl API, stepping the offset until total_count is reached."""
+    api_key = api_info['credentials']['user']
+    headers = {'Authorization': api_key}
+
+    offset = 0
+    while True:
+        params = {'start_date': start_date_str, 'end_date': end_date_str, 'max': MIRAKL_PAGE_SIZE, 'offset': offset}
+        response = http_request('GET', api_info['url'], connector=connector, headers=headers, params=params)
+        if not response.ok:
+            yield None, response.status_code
+            return
+        page = response.json()
+        yield page, response.status_code
+
+        offset += len(page.get('orders', []))
+        if not page.get('orders') or offset >= page.get('total_count', 0):
+            return
+
+def process_orders(orders, site):
+    """Process Mirakl orders."""
+    live_orders = [order for order in orders.get('orders', []) if order.get('order_state') != 'CANCELED']
+    return flatten_order_lines(
+        live_orders,
+        ('order_lines',),
+        {'sku': ('offer_sku',), 'qty': ('quantity',)},
+        site,
+        key=(f'mirakl:{site}', ('order_id',), ('order_line_id',)),
+    )
+
+def mirakl_main():
+    json_credentials = get_credentials()
+    current_datetime = watermark_now()
+    end_date_str = current_datetime.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    mirakl_sold = []
+    apis_to_process = ['THE BAY', 'VERISHOP', 'SSPO']
+    status_summary = {}
+
+    for site in apis_to_process:
+        api_info = json_credentials.get(site)
+        if api_info:
+            start_date_str = get_watermark(f'mirakl:{site}').strftime('%Y-%m-%dT%H:%M:%SZ')
+            sold, status_code = collect_pages(
+                fetch_mirakl_data(api_info, start_date_str, end_date_str, connector=f'mirakl:{site}'),
+                lambda orders: process_orders(orders, site),
+            )
+            status_summary[site] = status_code
+
+            if sold is not None:
+                mirakl_sold.append(sold)
+                stage_watermark(f'mirakl:{site}', current_datetime)
+            else:
+                logging.error(f'Error occurred for {site}. Status Code: {status_code}')
+
+    mirakl_sold = concat_order_lines(mirakl_sold)
+    return mirakl_sold, len(mirakl_sold), status_summary
+
+
+def get_wayfair_token(json_credentials):
+    """Retrieve the access token for Wayfair API."""
+    credentials = json_credentials['WAYFAIR']['credentials']
+
+    def request_token():
+        payload = {
+            "grant_type": "client_credentials",
+            "client_id": credentials['client_id'],
+            "client_secret": credentials['client_secret'],
+            "audience": credentials['audience']
+        }
+        headers = {
+            "content-type": "application/json",
+            "cache-control": "no-cache"
+        }
+        response = http_request('POST', json_credentials['WAYFAIR']['auth_url'], json=payload, headers=headers)
+        if not response.ok:
+            return None, None, response.status_code
+        token_data = response.json()
+        return token_data['access_token'], token_data.get('expires_in'), response.status_code
+
+    return cached_token('wayfair', credentials, request_token)
+
+
+WAYFAIR_PAGE_SIZE = 200
+
+WAYFAIR_ORDERS_QUERY = """
+query getDropshipPurchaseOrders($fromDate: IsoDateTime, $limit: Int32BitSigned) {
+    getDropshipPurchaseOrders(
+        limit: $limit,
+        hasResponse: false,
+        fromDate: $fromDate,
+        sortOrder: ASC
+    ) {
+        poNumber,
+        poDate,
+        products {
+            partNumber,
+            quantity
+        }
+    }
+}
+"""
+
+
+def fetch_wayfair_data(token, json_credentials, since):
+    """Yield (page, status_code) for purchase orders created after `since` from Wayfair API.
+
+    Pages are walked oldest-first by moving fromDate up to the last poDate seen;
+    orders repeated on a page boundary are dropped by poNumber.
+    """
+    from_date = since.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+    headers = {"Authorization": "Bearer " + token}
+    seen = set()
+
+    while True:
+        variables = {'fromDate': from_date, 'limit': WAYFAIR_PAGE_SIZE}
+        response = http_request('POST', json_credentials['WAYFAIR']['api_url'], connector='wayfair',
+                                json={'query': WAYFAIR_ORDERS_QUERY, 'variables': variables}, headers=headers)
+        if not response.ok:
+            print("Error in Wayfair API Response:", response.status_code, response.text)
+            yield None, response.status_code
+            return
+
+        page = response.json()
+        orders = (page.get('data') or {}).get('getDropshipPurchaseOrders')
+        if orders is None:
+            yield page, response.status_code
+            return
+
+        fresh = [order for order in orders if order.get('poNumber') not in seen]
+        seen.update(order.get('poNumber') for order in fresh)
+        page['data']['getDropshipPurchaseOrders'] = fresh
+        yield page, response.status_code
+
+        if len(orders) < WAYFAIR_PAGE_SIZE or not fresh:
+            return
+        from_date = max(order['poDate'] for order in orders)
+
+
+def process_wayfair_data(data):
+    try:
+        if 'data' in data and 'getDropshipPurchaseOrders' in data['data']:
+            orders = data['data']['getDropshipPurchaseOrders']
+            if not orders:
+                return empty_order_lines(), "No orders found"
+
+            all_products = []
+            for order in orders:
+                for position, product in enumerate(order.get('products', []), 1):
+                    partNumber = product.get('partNumber', '')
+                    quantity = product.get('quantity', 0)  
+
+                    
+                    all_products.append({
+                        'sku': partNumber,
+                        'qty': quantity,
+                        'site': 'Wayfair',
+                        LINE_KEY: order_line_key('wayfair', order.get('poNumber'), position),
+                    })
+
+            
+            products_df = to_order_lines(pd.DataFrame(all_products, columns=['sku', 'qty', 'site', LINE_KEY]))
+            return products_df, "Success"
+        else:
+            return empty_order_lines(), "Expected keys not found in the response"
+    except Exception as e:
+        return empty_order_lines(), f"Error processing Wayfair data: {str(e)}"
+
+
+def wayfair_main():
+    json_credentials = get_credentials()
+    token, auth_status = get_wayfair_token(json_credentials)
+    if token:
+        until = watermark_now()
+        statuses = []
+
+        def process_page(page):
+            frame, status = process_wayfair_data(page)
+            statuses.append(status)
+            return frame
+
+        wayfair_orders, fetch_status = collect_pages(fetch_wayfair_data(token, json_credentials, get_watermark('wayfair')), process_page)
+        if wayfair_orders is not None:
+            total_orders = len(wayfair_orders)
+            process_status = "Success" if "Success" in statuses else statuses[-1]
+            stage_watermark('wayfair', until)
+        else:
+            print(f"Error fetching Wayfair data. Status Code: {fetch_status}")
+            wayfair_orders = empty_order_lines()
+            total_orders = 0
+            process_status = f"Fetch error with status code {fetch_status}"
+    else:
+        print(f"Error obtaining Wayfair token. Status Code: {auth_status}")
+        wayfair_orders = empty_order_lines()
+        total_orders = 0
+        fetch_status = auth_status
+        process_status = f"Auth error with status code {auth_status}"
+
+    return wayfair_orders, total_orders, fetch_status, process_status
+
+
+
+# Local export files. 'columns' maps each needed source column to its
+# canonical name; only those columns are parsed. Exports without a column
+# mapped to 'site' are labelled with 'site'. 'keys' names the optional order
+# id and line number columns that line keys are built from.
+LOCAL_SOURCES = {
+    'macys': {
+        'path': '../sales/macys.csv', 'site': 'Macys',
+        'columns': {'Vendor SKU': 'sku', 'Quantity': 'qty', 'Merchant': 'site'},
+        'read': {'header': 4},
+    },
+    'hsn': {
+        'path': '../sales/hsn.xls', 'site': 'HSN',
+        'columns': {'Supplier Code': 'sku', 'QTY': 'qty', 'RequestorName': 'site'},
+    },
+    'rue': {
+        'path': '../sales/rue.xls', 'site': 'Ruelala & Gilt',
+        'columns': {'Vendor SKU': 'sku', 'Quantity': 'qty'},
+    },
+    'amazon': {
+        'path': '../sales/amazon.txt', 'site': 'Amazon',
+        'columns': {'sku': 'sku', 'quantity': 'qty'},
+        'read': {'sep': '\t'},
+        'chunksize': 250_000,
+    },
+    'walmart_file': {
+        'path': '../sales/walmart.xls', 'site': 'Walmart',
+        'columns': {'SKU': 'sku', 'Qty': 'qty'},
+        # Same key namespace as the Walmart API, so lines in both are counted once.
+        'keys': {'source': 'walmart', 'order_id': 'PO#', 'line_no': 'Line#'},
+    },
+    'tom': {
+        'path': '../sales/tom/tom.csv', 'site': 'Touch OF Modern',
+        'columns': {'Item SKU': 'sku', 'Qty': 'qty'},
+    },
+}
+
+# Faster parsers when they are installed; pandas' defaults otherwise.
+CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else None
+
+
+def read_source_file(spec):
+    """Read the mapped columns of a local export file as canonical order lines.
+
+    Only the columns in spec['columns'] are parsed, text columns are read as
+    str instead of being inferred, and sources with a 'chunksize' are read
+    and converted a chunk at a time.
+    """
+    path = spec['path']
+    columns = spec['columns']
+    keys = spec.get('keys')
+    dtypes = {column: str for column, target in columns.items() if target != 'qty'}
+    usecols = list(columns)
+    csv_engine = CSV_ENGINE
+    if keys:
+        # Key columns are optional: an export without them just yields unkeyed lines.
+        key_columns = (keys['order_id'], keys['line_no'])
+        dtypes.update(dict.fromkeys(key_columns, str))
+        usecols = lambda column: column in columns or column in key_columns
+        csv_engine = 'c'
+    options = dict(usecols=usecols, dtype=dtypes, **spec.get('read', {}))
+
+    def to_lines(data):
+        if keys and keys['order_id'] in data and keys['line_no'] in data:
+            order_ids = data[keys['order_id']].str.strip()
+            data[LINE_KEY] = (f"{keys['source']}|" + order_ids + '|' + data[keys['line_no']].str.strip()).where(
+                order_ids.notna() & (order_ids != ''), None)
+        data = data.rename(columns=columns)
+        return to_order_lines(data, site=None if 'site' in data else spec['site'])
+
+    if path.endswith(('.xls', '.xlsx')):
+        return to_lines(pd.read_excel(path, engine=EXCEL_ENGINE, **options))
+    if spec.get('chunksize'):
+        return concat_order_lines(to_lines(chunk) for chunk in pd.read_csv(path, chunksize=spec['chunksize'], **options))
+    return to_lines(pd.read_csv(path, engine=csv_engine, **options))
+
+
+def read_cached_source(name, spec):
+    """Return a local source's order lines, re-parsing the file only when it changed.
+
+    Parsed frames are cached under CACHE_DIR/sources, keyed by the file's
+    fingerprint and by the spec itself, so editing a column mapping also
+    invalidates the entry. Returns (frame, 'hit' or 'miss').
+    """
+    cache_path = os.path.join(CACHE_DIR, 'sources', name)
+    spec_digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+    known = read_cache_meta(cache_path)
+    fingerprint = source_fingerprint(spec['path'], known)
+    fingerprint['spec'] = spec_digest
+
+    if (known and known.get('sha256') == fingerprint['sha256'] and known.get('spec') == spec_digest
+            and os.path.exists(known.get('cache_file', ''))):
+        fingerprint['cache_file'] = known['cache_file']
+        status = 'hit'
+        data = to_order_lines(read_cached_frame(known['cache_file']))
+    else:
+        status = 'miss'
+        data = read_source_file(spec)
+        fingerprint['cache_file'] = write_cached_frame(data, cache_path)
+
+    if fingerprint != known:
+        write_cache_meta(cache_path, fingerprint)
+    return data, status
+
+
+def process_file_data(name, spec):
+    """Read one local export file, falling back to a placeholder line when it is missing.
+
+    Returns (frame, total_orders, cache_status).
+    """
+    PATH = spec['path']
+    site_name = spec['site']
+    if os.path.isfile(PATH) and os.access(PATH, os.R_OK):
+        print(f"File for {site_name} is OKAY")
+        data, cache_status = read_cached_source(name, spec)
+        total_orders = len(data)
+    else:
+        print(f"Either the file for {site_name} is missing or not readable")
+        data = to_order_lines(pd.DataFrame({'sku': ['other'], 'qty': [0], 'site': [site_name]}))
+        total_orders = 0
+        cache_status = 'missing'
+
+    return data, total_orders, cache_status
+
+
+def load_local_sales(sources=None):
+    """Read the marketplace export files under ../sales/ into {source: frame}."""
+    sources = LOCAL_SOURCES if sources is None else sources
+    frames = {}
+    for name, spec in sources.items():
+        with span('parse', name) as record:
+            frames[name], total_orders, cache_status = process_file_data(name, spec)
+            frames[name] = gather_order_lines([frames[name]])
+            record.update(rows_out=total_orders, cache=cache_status)
+        print(f"{spec['site']} Total Order: {total_orders} (cache {cache_status})")
+    return frames
+
+
+CONNECTORS = {
+    'walmart': walmart_main,
+    'houzz': houzz_main,
+    'faire': faire_main,
+    'brand1': brand1_main,
+    'dsco': dsco_main,
+    'mirakl': mirakl_main,
+    'wayfair': wayfair_main,
+}
+
+CONNECTOR_TIMEOUT = 300
+CONNECTOR_WORKERS = 4
+
+
+def run_connectors(connectors=None, max_workers=CONNECTOR_WORKERS, timeout=CONNECTOR_TIMEOUT):
+    """Run the marketplace connectors concurrently.
+
+    `timeout` is either a number of seconds applied to every connector or a
+    dict of per-connector overrides. A connector's clock starts when it gets
+    a worker, so queueing behind the concurrency cap does not count against it.
+    Connectors run on daemon threads: a timed-out one cannot be stopped, so a
+    replacement worker takes over the queue and the abandoned thread exits
+    once it returns; it never keeps the process alive after the run.
+    Returns {name: (frame, total_orders, status)}; a connector that times out
+    or raises contributes an empty frame and a 'timeout'/None status, and the
+    watermarks it staged are dropped.
+    """
+    connectors = CONNECTORS if connectors is None else connectors
+    started = {}
+    abandoned = set()
+
+    def run_one(name, func):
+        started[name] = time.monotonic()
+        _connector_marks.marks = marks = {}
+        try:
+            with span('extract', name) as record:
+                result = func()
+                record.update(rows_out=len(result[0]), source_status=result[2])
+        finally:
+            _connector_marks.marks = None
+        return result, marks
+
+    def limit_for(name):
+        if isinstance(timeout, dict):
+            return timeout.get(name, CONNECTOR_TIMEOUT)
+        return timeout
+
+    jobs = queue.Queue()
+    futures = {}
+    for name, func in connectors.items():
+        future = Future()
+        futures[future] = name
+        jobs.put((future, name, func))
+
+    def work():
+        while True:
+            try:
+                future, name, func = jobs.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(run_one(name, func))
+            except BaseException as e:
+                future.set_exception(e)
+            if name in abandoned:
+                return  # a replacement worker was started when this connector timed out
+
+    # concurrent.futures joins its worker threads at exit, which would wait out a hung connector.
+    workers = itertools.count()
+
+    def start_worker():
+        threading.Thread(target=work, name=f'connector_{next(workers)}', daemon=True).start()
+
+    for _ in range(min(max_workers, len(futures))):
+        start_worker()
+
+    results = {}
+    pending = set(futures)
+
+    while pending:
+        done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            try:
+                result, marks = future.result()
+                # wayfair_main also reports a processing status after the first three fields.
+                results[name] = tuple(result[:3])
+                for connector, high_water in marks.items():
+                    stage_watermark(connector, high_water)
+            except Exception as e:
+                print(f"An error occurred in {name}: {e}")
+                results[name] = (empty_order_lines(), 0, None)
+
+        now = time.monotonic()
+        for future in list(pending):
+            name = futures[future]
+            if name in started and not future.done() and now - started[name] > limit_for(name):
+                print(f"{name} timed out after {limit_for(name)}s")
+                record_span({'stage': 'extract', 'name': name, 'status': 'timeout', 'seconds': limit_for(name),
+                             'peak_rss_bytes': peak_rss_bytes()})
+                future.cancel()
+                pending.discard(future)
+                results[name] = (empty_order_lines(), 0, 'timeout')
+                abandoned.add(name)
+                if not jobs.empty():
+                    start_worker()
+
+    return {name: results[name] for name in connectors}
+
+
+def report_connector_results(results):
+    """Print the per-connector status lines for a run."""
+    for name, (frame, total_orders, status) in results.items():
+        if isinstance(status, dict):
+            print(f'{name.upper()} Total Orders: {total_orders}')
+            for api_name, status_code in status.items():
+                print(f'{api_name} API Status: {status_code}')
+        else:
+            print(f'{name.capitalize()} API Status: {status}, Total Orders: {total_orders}')
+
+
+def combine_sales(frames):
+    """Concatenate every source's sku/qty/site frame into one sales frame."""
+    sales = concat_order_lines(frames)
+
+    print(sales.head())
+    print(f'Total Combined Orders: {len(sales)}')
+    return sales
+
+
+SEEN_LINE_RETENTION = timedelta(days=90)
+
+
+def seen_line_keys(keys, run_id):
+    """Return the subset of `keys` already counted by a run other than `run_id`.
+
+    The batch is loaded into a temporary table and joined against the
+    seen_lines primary key, so each key costs one index probe.
+    """
+    conn = state_db()
+    try:
+        conn.execute('CREATE TEMP TABLE batch_keys (line_key TEXT PRIMARY KEY) WITHOUT ROWID')
+        conn.executemany('INSERT OR IGNORE INTO batch_keys VALUES (?)', ((key,) for key in keys))
+        rows = conn.execute(
+            'SELECT s.line_key FROM batch_keys b JOIN seen_lines s ON s.line_key = b.line_key WHERE s.run_id != ?',
+            (run_id,))
+        return {line_key for line_key, in rows}
+    finally:
+        conn.close()
+
+
+def dedupe_order_lines(sales, run_id, check_seen=True):
+    """Drop order lines that appear twice in this run or were counted by an earlier one.
+
+    Only lines with a line key can be recognized; unkeyed lines (aggregate
+    exports) always pass. With `check_seen` False only repeats within the
+    batch are dropped. Returns (sales, keys of the lines kept), the keys to
+    be recorded alongside this run's stock movements.
+    """
+    if LINE_KEY not in sales:
+        return sales, []
+    keys = sales[LINE_KEY]
+    keyed = keys.notna().to_numpy()
+    repeated = keyed & keys.duplicated().to_numpy()
+    counted = np.zeros(len(keys), dtype=bool)
+    if check_seen:
+        counted = keyed & keys.isin(seen_line_keys(keys[keyed & ~repeated].tolist(), run_id)).to_numpy()
+
+    drop = repeated | counted
+    if drop.any():
+        print(f"Dropped {int(repeated.sum())} repeated and {int(counted.sum())} already counted order lines")
+    sales = sales[~drop].reset_index(drop=True)
+    return sales, sales[LINE_KEY].dropna().tolist()
+
+
+def record_seen_lines(conn, run_id, keys, sources=None):
+    """Mark a run's order lines as counted, replacing what an earlier attempt of the run recorded.
+
+    Called in the same transaction as the run's stock movements, so a line is
+    marked seen exactly when its quantity leaves stock. In streaming mode the
+    keys staged by the windows of `sources` are promoted as well. Keys older
+    than SEEN_LINE_RETENTION, far outside any extraction window, are pruned.
+    """
+    seen_at = datetime.datetime.now()
+    conn.execute('DELETE FROM seen_lines WHERE run_id = ?', (run_id,))
+    conn.executemany('INSERT OR IGNORE INTO seen_lines (line_key, run_id, seen_at) VALUES (?, ?, ?)',
+                     ((key, run_id, seen_at.isoformat()) for key in keys))
+    conn.execute('DELETE FROM seen_lines WHERE seen_at < ?', ((seen_at - SEEN_LINE_RETENTION).isoformat(),))
+    if sources:
+        conn.execute(
+            f"INSERT OR IGNORE INTO seen_lines (line_key, run_id, seen_at) SELECT line_key, run_id, ? "
+            f"FROM pending_lines WHERE run_id = ? AND source IN ({', '.join('?' * len(sources))})",
+            (seen_at.isoformat(), run_id, *sources))
+    conn.execute('DELETE FROM pending_lines WHERE run_id = ?', (run_id,))
+
+
+_stream = {'run_id': None, 'check_seen': True, 'failed': []}
+
+
+def configure_streaming(run_id, check_seen=True):
+    """Fold order lines into running totals for `run_id` as they arrive, or stop doing so (None).
+
+    Line keys staged by an earlier, unfinished attempt of the run are dropped
+    either way, so they cannot hide lines from this attempt. `check_seen` is
+    as for dedupe_order_lines.
+    """
+    previous = _stream['run_id']
+    _stream.update(run_id=run_id, check_seen=check_seen, failed=[])
+    stale = run_id or previous
+    if stale:
+        conn = state_db()
+        try:
+            with conn:
+                conn.execute('DELETE FROM pending_lines WHERE run_id = ?', (stale,))
+        finally:
+            conn.close()
+
+
+class OrderLineTotals:
+    """Running (sku, site) -> qty totals over a window of order-line batches.
+
+    Memory is bounded by the distinct (sku, site) pairs, not by the number of
+    lines. Keyed lines are deduplicated as they arrive: the keys admitted so
+    far are staged in the pending_lines table instead of being held in
+    memory, and only become seen lines when the run's stock update promotes
+    them. A window that fails part-way is discarded along with its staged keys.
+    """
+
+    def __init__(self, run_id, source, check_seen=True):
+        self.run_id = run_id
+        self.source = source
+        self.check_seen = check_seen
+        self.stream_id = os.urandom(8).hex()
+        self.totals = collections.Counter()
+        self.lines = 0
+        self.conn = None
+
+    def admit(self, keys):
+        """Stage the batch's new line keys and return the mask of lines to keep."""
+        keyed = keys.notna().to_numpy()
+        repeated = keyed & keys.duplicated().to_numpy()
+        candidates = keys[keyed & ~repeated].tolist()
+        if self.conn is None:
+            self.conn = state_db()
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_keys (line_key TEXT PRIMARY KEY) WITHOUT ROWID')
+        # Take the write lock up front: two streams that both read in a deferred
+        # transaction and then upgrade to write fail one of them at once with
+        # "database is locked", busy timeout or not.
+        self.conn.execute('BEGIN IMMEDIATE')
+        with self.conn as conn:
+            conn.execute('DELETE FROM batch_keys')
+            conn.executemany('INSERT OR IGNORE INTO batch_keys VALUES (?)', ((key,) for key in candidates))
+            rejected = {line_key for line_key, in conn.execute(
+                'SELECT b.line_key FROM batch_keys b '
+                'WHERE (? AND EXISTS (SELECT 1 FROM seen_lines s WHERE s.line_key = b.line_key AND s.run_id != ?)) '
+                'OR EXISTS (SELECT 1 FROM pending_lines p WHERE p.run_id = ? AND p.line_key = b.line_key)',
+                (self.check_seen, self.run_id, self.run_id))}
+            conn.executemany(
+                'INSERT OR IGNORE INTO pending_lines (run_id, line_key, source, stream_id) VALUES (?, ?, ?, ?)',
+                [(self.run_id, key, self.source, self.stream_id) for key in candidates if key not in rejected])
+        return ~(repeated | (keyed & keys.isin(rejected).to_numpy()))
+
+    def add(self, batch):
+        batch = to_order_lines(batch)
+        self.lines += len(batch)
+        if LINE_KEY in batch:
+            batch = batch[self.admit(batch[LINE_KEY])]
+        sums = normalize_sales(batch).groupby(['sku', 'site'], observed=True)['qty'].sum()
+        for pair, qty in sums.items():
+            self.totals[pair] += int(qty)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def discard(self):
+        """Forget the window's totals and the keys it staged."""
+        if self.conn is None:
+            self.conn = state_db()
+        with self.conn as conn:
+            conn.execute('DELETE FROM pending_lines WHERE run_id = ? AND stream_id = ?', (self.run_id, self.stream_id))
+        self.close()
+        self.totals.clear()
+
+    def finish(self):
+        """Return the window's totals as order lines, one per (sku, site)."""
+        self.close()
+        add_to_span(lines_in=self.lines)
+        if not self.totals:
+            return empty_order_lines()
+        (skus, sites), qtys = zip(*self.totals.keys()), list(self.totals.values())
+        return to_order_lines(pd.DataFrame({'sku': skus, 'qty': qtys, 'site': sites}))
+
+
+def gather_order_lines(batches):
+    """Concatenate order-line batches or, in streaming mode, fold them into running totals.
+
+    The active span names the source the streamed lines are staged under. A
+    source whose keys could not be staged is remembered in _stream['failed']
+    so the run fails even if its connector swallows the error.
+    """
+    if _stream['run_id'] is None:
+        return concat_order_lines(batches)
+    record = current_span()
+    totals = OrderLineTotals(_stream['run_id'], (record or {}).get('name') or 'unknown', _stream['check_seen'])
+    try:
+        for batch in batches:
+            totals.add(batch)
+    except BaseException as e:
+        if isinstance(e, sqlite3.Error):
+            _stream['failed'].append(totals.source)
+        totals.discard()
+        raise
+    return totals.finish()
+
+
+def recode_categories(values, func):
+    """Apply `func` once per distinct value of a categorical Series.
+
+    Values that map to the same result share a category afterwards, and the
+    categories come back sorted.
+    """
+    mapped = pd.Categorical(values.cat.categories.map(func))
+    codes = values.cat.codes.to_numpy()
+    new_codes = np.full(len(codes), -1, dtype=mapped.codes.dtype)
+    present = codes >= 0
+    new_codes[present] = mapped.codes[codes[present]]
+    return pd.Series(pd.Categorical.from_codes(new_codes, mapped.categories), index=values.index, name=values.name)
+
+
+# Header rows leaking in from the exports ('sku', 'Item SKU') and the
+# placeholder line a missing export file contributes ('other').
+JUNK_SKU_MARKERS = ('sku', 'other')
+
+
+@functools.lru_cache(maxsize=None)
+def canonical_sku(raw):
+    """Return the lowercased, stripped form of a raw SKU, or None for a junk row."""
+    sku = raw.strip().lower()
+    if any(marker in sku for marker in JUNK_SKU_MARKERS):
+        return None
+    return sku
+
+
+def normalize_sales(sales):
+    """Canonicalize SKUs and sites and drop junk rows in a single pass.
+
+    Each distinct raw SKU goes through canonical_sku once (memoized across
+    calls), junk SKUs map to a missing category, and one mask over the codes
+    removes them. Kept lines keep their index labels.
+    """
+    sku = recode_categories(sales['sku'], canonical_sku)
+    keep = (sku.cat.codes >= 0).to_numpy()
+    return pd.DataFrame({
+        'sku': sku.array[keep],
+        'qty': sales['qty'].to_numpy()[keep],
+        'site': recode_categories(sales['site'], str.lower).array[keep],
+    }, index=sales.index[keep])
+
+
+RETAIL_TOTALS_PATH = "soldvalueretail.csv"
+WHOLESALE_TOTALS_PATH = "sold_itemswholesale.csv"
+
+
+ENGINES = ('pandas', 'arrow')
+DEFAULT_ENGINE = 'pandas'
+
+
+def require_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {ENGINES}, not {engine!r}")
+    if engine == 'arrow' and pa is None:
+        raise ImportError("the arrow engine needs pyarrow")
+
+
+def arrow_strings(sales):
+    """Return normalized order lines with `sku` and `site` as Arrow-backed strings."""
+    string = pd.ArrowDtype(pa.string())
+    return sales.assign(sku=sales['sku'].astype(string), site=sales['site'].astype(string))
+
+
+def retail_totals(sales, engine=DEFAULT_ENGINE):
+    """Total the sold quantity per retail SKU, sorted by SKU.
+
+    The arrow engine groups with pyarrow's hash aggregation; both engines
+    order SKUs by code point, so their results are identical.
+    """
+    if engine == 'arrow':
+        table = pa.table({'sku': pa.array(sales['sku'].array), 'qty': pa.array(sales['qty'].to_numpy())})
+        totals = table.group_by('sku').aggregate([('qty', 'sum')]).sort_by('sku')
+        return pd.DataFrame({
+            'sku': totals['sku'].to_numpy().astype(object),
+            'qty': totals['qty_sum'].to_numpy(),
+        })
+    # groupby already returns the SKUs sorted; no sorted copy of the lines is needed.
+    soldvalue = sales.groupby(["sku"], observed=True).qty.sum().reset_index()
+    soldvalue['sku'] = soldvalue['sku'].astype(str)
+    return soldvalue
+
+
+def summarize_retail_sales(sales, engine=DEFAULT_ENGINE, publish=True):
+    """Total the sold quantity per retail SKU and, with `publish`, write soldvalueretail.csv."""
+    soldvalue = retail_totals(sales, engine)
+    if publish:
+        soldvalue.to_csv(RETAIL_TOTALS_PATH)
+    return soldvalue
+
+
+CACHE_DIR = './cache'
+SKU_MAP_PATH = './skus/skus_map.csv'
+BUNDLE_INDEX_PATH = os.path.join(CACHE_DIR, 'bundle_index.npz')
+
+
+def file_sha256(path):
+    """Hash a file's contents in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(path, known=None):
+    """Describe a source file for cache invalidation.
+
+    mtime and size are checked first and the content hash is only recomputed
+    when they moved, so a file that was touched but not edited keeps its
+    caches. Compare the 'sha256' entries to decide freshness.
+    """
+    stat = os.stat(path)
+    fingerprint = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    if known and known.get('mtime_ns') == stat.st_mtime_ns and known.get('size') == stat.st_size:
+        fingerprint['sha256'] = known.get('sha256')
+    else:
+        fingerprint['sha256'] = file_sha256(path)
+    return fingerprint
+
+
+def read_cache_meta(cache_path):
+    """Return the metadata stored next to a cache file, or None."""
+    try:
+        with open(f'{cache_path}.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_meta(cache_path, meta):
+    """Store the metadata (source fingerprint and friends) next to a cache file."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f'{cache_path}.json.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, f'{cache_path}.json')
+
+
+def build_bundle_index(path=SKU_MAP_PATH):
+    """Compile skus_map.csv into integer-coded arrays.
+
+    Each map row becomes a (component, part, multiplier) triplet: together
+    they are a sparse component x retail-SKU matrix in coordinate form.
+    """
+    sku_map = pd.read_csv(path, usecols=['sku_name', 'sku_part', 'multiplier'],
+                          dtype={'sku_name': str, 'sku_part': str})
+    sku_map = sku_map[sku_map['sku_name'].notna()]
+    names, name_codes = np.unique(sku_map['sku_name'].to_numpy(dtype=str), return_inverse=True)
+
+    # Rows without a part still list their component, with nothing to add to it.
+    linked = sku_map['sku_part'].notna().to_numpy()
+    parts, part_codes = np.unique(sku_map['sku_part'][linked].to_numpy(dtype=str), return_inverse=True)
+    multipliers = pd.to_numeric(sku_map['multiplier'], errors='coerce').fillna(0).to_numpy(dtype='float64')[linked]
+
+    return {
+        'names': names,
+        'parts': parts,
+        'name_codes': name_codes[linked].astype('int32'),
+        'part_codes': part_codes.astype('int32'),
+        'multipliers': multipliers,
+    }
+
+
+def load_bundle_index(path=SKU_MAP_PATH, cache_path=BUNDLE_INDEX_PATH):
+    """Return the compiled bundle index, rebuilding the cached copy when skus_map.csv changes."""
+    known = read_cache_meta(cache_path)
+    fingerprint = source_fingerprint(path, known)
+    if known and known.get('sha256') == fingerprint['sha256'] and os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as cached:
+            index = {key: cached[key] for key in cached.files}
+    else:
+        index = build_bundle_index(path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Per-process temp names: shard workers may rebuild a cold cache at the same time.
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, **index)
+        os.replace(tmp_path, cache_path)
+
+    if fingerprint != known:
+        write_cache_meta(cache_path, fingerprint)
+    return index
+
+
+def bundle_components(soldvalue, index):
+    """Return the wholesale component totals for retail SKU totals, aligned with index['names'].
+
+    The compiled index turns the expansion into one sparse mat-vec: gather the
+    sold quantity of each map row's part, scale by its multiplier and
+    scatter-add into the component totals. The expansion is linear, so totals
+    of disjoint SKU sets can simply be added up.
+    """
+    part_qty = np.zeros(len(index['parts']))
+    positions = pd.Index(index['parts']).get_indexer(soldvalue['sku'])
+    found = positions >= 0
+    part_qty[positions[found]] = soldvalue['qty'].to_numpy()[found]
+
+    return np.bincount(
+        index['name_codes'],
+        weights=part_qty[index['part_codes']] * index['multipliers'],
+        minlength=len(index['names']),
+    )
+
+
+def component_totals_frame(index, totals):
+    return pd.DataFrame({'sku': index['names'].astype(object), 'qty': totals})
+
+
+def publish_component_totals(index, totals):
+    """Turn component totals into the final_result frame and write sold_itemswholesale.csv."""
+    final_result = component_totals_frame(index, totals)
+    print(final_result)
+
+    final_result.to_csv(WHOLESALE_TOTALS_PATH)
+    return final_result
+
+
+def expand_bundles(soldvalue, publish=True):
+    """Convert retail SKU totals into wholesale component totals via skus_map.csv."""
+    index = load_bundle_index()
+    totals = bundle_components(soldvalue, index)
+    return publish_component_totals(index, totals) if publish else component_totals_frame(index, totals)
+
+
+TRANSFORM_SHARDS = 1
+
+
+def shard_assignment(skus, shards):
+    """Assign each line to a shard by a stable hash of its canonical SKU.
+
+    The hash is taken once per category, so every spelling of a SKU that
+    canonicalizes alike lands on the same shard.
+    """
+    shard_of_category = np.array([
+        int.from_bytes(hashlib.blake2b(str(sku).strip().lower().encode(), digest_size=8).digest(), 'little') % shards
+        for sku in skus.cat.categories
+    ], dtype='int64')
+    codes = skus.cat.codes.to_numpy()
+    return np.where(codes >= 0, shard_of_category[np.maximum(codes, 0)], 0)
+
+
+def transform_shard(lines, enrich, engine=DEFAULT_ENGINE):
+    """Run the per-line transform on one shard in a worker process.
+
+    Returns (normalized or enriched lines, retail totals, component totals),
+    the partial results transform_sharded merges.
+    """
+    sales = normalize_sales(lines)
+    if engine == 'arrow':
+        sales = arrow_strings(sales)
+    soldvalue = retail_totals(sales, engine)
+    components = bundle_components(soldvalue, load_bundle_index())
+    if enrich:
+        sales = enrich_sales(sales)
+    return sales, soldvalue, components
+
+
+def transform_sharded(sales, shards, enrich=False, max_workers=None, engine=DEFAULT_ENGINE, publish=True):
+    """Normalize, total, expand and optionally enrich `sales` across a process pool.
+
+    Lines are hash-partitioned by SKU, so the shards' retail totals cover
+    disjoint SKUs and merge by concatenation, and their component totals merge
+    by addition. Lines come back in their original order. With `publish`,
+    writes the same soldvalueretail.csv and sold_itemswholesale.csv as the
+    single-process path.
+    Returns (sales, soldvalue, final_result).
+    """
+    assignment = shard_assignment(sales['sku'], shards)
+    parts = []
+    for shard in range(shards):
+        part = sales[assignment == shard]
+        parts.append(part.assign(sku=part['sku'].cat.remove_unused_categories()))
+
+    # Warm the caches the workers read before they start, so they never rebuild them concurrently.
+    index = load_bundle_index()
+    if enrich:
+        load_dimension('sales_map')
+
+    max_workers = max_workers or min(shards, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(transform_shard, parts, [enrich] * shards, [engine] * shards))
+
+    sales = pd.concat([lines for lines, _, _ in results]).sort_index()
+    soldvalue = pd.concat([totals for _, totals, _ in results]).sort_values('sku', ignore_index=True)
+    components = sum(components for _, _, components in results)
+    if not publish:
+        return sales, soldvalue, component_totals_frame(index, components)
+    soldvalue.to_csv(RETAIL_TOTALS_PATH)
+    final_result = publish_component_totals(index, components)
+    return sales, soldvalue, final_result
+
+
+STOCK_SOURCE_PATH = '../cloudbbeh/stockfiles/newstock.csv'
+STOCK_SNAPSHOT_PATHS = [
+    STOCK_SOURCE_PATH,
+    '../cloudbbeh/stock/data/newstock.csv',
+    '../cloudbbeh/gonder/newstock.csv',
+]
+STOCK_COLUMNS = ['sku', 'qty', 'subcategory', 'color', 'brand']
+
+
+def run_identity():
+    """Identify a run by its date and the committed watermarks it starts from.
+
+    A retry before the watermarks were committed reads the same window and
+    gets the same id, so its stock movements replace the failed attempt's
+    instead of being applied twice.
+    """
+    conn = state_db()
+    try:
+        marks = conn.execute('SELECT connector, high_water FROM watermarks ORDER BY connector').fetchall()
+    finally:
+        conn.close()
+    digest = hashlib.sha256(json.dumps(marks).encode()).hexdigest()[:12]
+    return f"{datetime.datetime.now():%Y%m%d}-{digest}"
+
+
+def _get_state(conn, key):
+    row = conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, value))
+
+
+def sync_stock_from_snapshot(conn, path=STOCK_SOURCE_PATH):
+    """Reload current stock from the snapshot file when it was changed outside the pipeline.
+
+    The file is the source of truth for counts entered by hand (receiving,
+    recounts); as long as it is the snapshot this pipeline last wrote, the
+    materialized table is used as-is.
+    """
+    digest = file_sha256(path)
+    if digest == _get_state(conn, 'stock_snapshot_sha256') and conn.execute('SELECT 1 FROM stock_current LIMIT 1').fetchone():
+        return False
+
+    stock = pd.read_csv(path, usecols=STOCK_COLUMNS, dtype={'sku': str, 'subcategory': str, 'color': str, 'brand': str})
+    stock['qty'] = pd.to_numeric(stock['qty'], errors='coerce')
+    stock = stock.drop_duplicates('sku')
+    conn.execute('DELETE FROM stock_current')
+    conn.executemany(
+        'INSERT INTO stock_current (sku, qty, subcategory, color, brand) VALUES (?, ?, ?, ?, ?)',
+        stock[STOCK_COLUMNS].astype(object).where(stock[STOCK_COLUMNS].notna(), None).itertuples(index=False, name=None),
+    )
+    _set_state(conn, 'stock_snapshot_sha256', digest)
+    return True
+
+
+def record_stock_movements(conn, run_id, final_result):
+    """Append a run's sold quantities to the stock ledger and fold them into current stock.
+
+    Movements are per (run_id, wholesale sku): the run's order lines are kept
+    in seen_lines, not in the ledger. The ledger is never
+    rewritten: recording the same run again appends only the difference from
+    what that run already recorded, so a re-run never double-decrements.
+    """
+    sold = final_result[final_result['qty'] != 0]
+    target = dict(zip(sold['sku'].astype(str), -sold['qty'].astype(float)))
+    recorded = dict(conn.execute(
+        'SELECT sku, SUM(qty) FROM stock_movements WHERE run_id = ? GROUP BY sku', (run_id,)))
+
+    deltas = {sku: target.get(sku, 0.0) - recorded.get(sku, 0.0) for sku in set(target) | set(recorded)}
+    deltas = {sku: delta for sku, delta in deltas.items() if delta}
+    recorded_at = datetime.datetime.now().isoformat()
+
+    conn.executemany(
+        'INSERT INTO stock_movements (run_id, sku, qty, recorded_at) VALUES (?, ?, ?, ?)',
+        [(run_id, sku, delta, recorded_at) for sku, delta in deltas.items()],
+    )
+    conn.executemany('UPDATE stock_current SET qty = qty + ? WHERE sku = ?', [(delta, sku) for sku, delta in deltas.items()])
+
+
+def write_stock_snapshot(conn, paths=STOCK_SNAPSHOT_PATHS):
+    """Materialize current stock once and publish it to every destination by atomic rename."""
+    stock = pd.read_sql_query(f'SELECT {", ".join(STOCK_COLUMNS)} FROM stock_current ORDER BY rowid', conn)
+
+    primary = paths[0]
+    stock.to_csv(f'{primary}.tmp', index=False)
+    os.replace(f'{primary}.tmp', primary)
+    for path in paths[1:]:
+        shutil.copyfile(primary, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+    _set_state(conn, 'stock_snapshot_sha256', file_sha256(primary))
+    return stock
+
+
+def update_stock(final_result, run_id, line_keys=None, sources=None):
+    """Subtract the sold wholesale quantities from stock and publish the new snapshot.
+
+    `line_keys` are the order lines behind `final_result`, plus, when
+    streaming, the keys staged by `sources`; they are marked seen in the same
+    transaction as the stock movements.
+    """
+    conn = state_db()
+    try:
+        with conn:
+            sync_stock_from_snapshot(conn)
+            record_stock_movements(conn, run_id, final_result)
+            if line_keys is not None:
+                record_seen_lines(conn, run_id, line_keys, sources)
+        with conn:
+            final_df = write_stock_snapshot(conn)
+    finally:
+        conn.close()
+    print(final_df)
+    return final_df
+
+
+DIMENSIONS = {
+    'sales_map': {'path': './skus/sales_map.csv', 'key': 'SKU'},
+    'wholesale_sold_map': {'path': './skus/wholesale_sold_map.csv', 'key': 'sku'},
+}
+
+_dimensions = {}
+
+
+def write_cached_frame(frame, path):
+    """Atomically write a cache frame as Parquet, or as a pickle when no Parquet engine is installed.
+
+    Returns the file written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    suffix = f'{os.getpid()}.tmp'
+    try:
+        target = f'{path}.parquet'
+        frame.to_parquet(f'{target}.{suffix}')
+    except ImportError:
+        target = f'{path}.pkl'
+        frame.to_pickle(f'{target}.{suffix}')
+    os.replace(f'{target}.{suffix}', target)
+    return target
+
+
+def read_cached_frame(target):
+    """Read a frame written by write_cached_frame."""
+    if target.endswith('.parquet'):
+        return pd.read_parquet(target)
+    return pd.read_pickle(target)
+
+
+def build_dimension(path, key):
+    """Read a SKU map into a table indexed by its stripped key, with text attributes dictionary-coded."""
+    table = pd.read_csv(path, dtype={key: str})
+    table = table[table[key].notna()]
+    table[key] = table[key].str.strip()
+
+    duplicates = table[key].duplicated()
+    if duplicates.any():
+        print(f"{os.path.basename(path)}: {int(duplicates.sum())} duplicate {key} rows ignored, first one wins")
+        table = table[~duplicates]
+
+    table = table.set_index(key)
+    if 'cost' in table.columns:
+        table['cost'] = pd.to_numeric(table['cost'], errors='coerce')
+    for column in table.columns:
+        if table[column].dtype == object:
+            table[column] = table[column].astype('category')
+    return table
+
+
+def load_dimension(name):
+    """Return a dimension table, re-reading its CSV only when the file changed.
+
+    The built table is kept in memory for the process and on disk under
+    CACHE_DIR, keyed by the source fingerprint.
+    """
+    spec = DIMENSIONS[name]
+    cache_path = os.path.join(CACHE_DIR, 'dimensions', name)
+    known = read_cache_meta(cache_path)
+    fingerprint = source_fingerprint(spec['path'], known)
+    cached = _dimensions.get(name)
+    if cached is not None and cached[0] == fingerprint['sha256']:
+        return cached[1]
+
+    if known and known.get('sha256') == fingerprint['sha256'] and os.path.exists(known.get('cache_file', '')):
+        table = read_cached_frame(known['cache_file'])
+        fingerprint['cache_file'] = known['cache_file']
+    else:
+        table = build_dimension(spec['path'], spec['key'])
+        fingerprint['cache_file'] = write_cached_frame(table, cache_path)
+
+    if fingerprint != known:
+        write_cache_meta(cache_path, fingerprint)
+    _dimensions[name] = (fingerprint['sha256'], table)
+    return table
+
+
+def lookup_dimension(keys, dimension):
+    """Return the dimension attributes for each key, aligned to `keys`.
+
+    Keys are resolved to row positions with one index lookup (once per
+    category for categorical keys) and every attribute column is gathered by
+    position; unknown keys come back as missing values.
+    """
+    if isinstance(keys.dtype, pd.CategoricalDtype):
+        category_positions = dimension.index.get_indexer(keys.cat.categories.astype(str))
+        codes = keys.cat.codes.to_numpy()
+        positions = np.full(len(codes), -1, dtype='intp')
+        present = codes >= 0
+        positions[present] = category_positions[codes[present]]
+    elif isinstance(keys.dtype, pd.ArrowDtype):
+        found = pc.index_in(pc.utf8_trim_whitespace(pa.array(keys.array)),
+                            value_set=pa.array(dimension.index.astype(str).to_numpy()))
+        positions = pc.fill_null(found, -1).to_numpy().astype('intp')
+    else:
+        positions = dimension.index.get_indexer(keys.astype(str).str.strip())
+
+    return pd.DataFrame(
+        {column: take(dimension[column].array, positions, allow_fill=True) for column in dimension.columns},
+        index=keys.index,
+    )
+
+
+def enrich_sales(sales):
+    """Attach sales_map.csv attributes, the run date and line totals to the sales lines."""
+    sales = pd.concat([sales, lookup_dimension(sales['sku'], load_dimension('sales_map'))], axis=1)
+
+    current_date = datetime.datetime.now()
+    sales['date'] = current_date.date()
+    sales['Year'] = current_date.year
+    sales['Month'] = calendar.month_name[current_date.month]
+
+    sales['date'] = pd.to_datetime(sales['date'])
+
+    sales["cost"] = pd.to_numeric(sales["cost"], errors='coerce')
+
+    sales["total"] = sales["qty"] * sales["cost"]
+    return sales
+
+
+BRAND_OUTPUT_ROOTS = {'brand1': '../cloudbbeh/eh', 'brand2': '../cloudbbeh/bb'}
+
+
+def daily_output_dir(brand, when, *parts):
+    """Return the dated output directory of a brand for `when`'s year, creating it if needed."""
+    path = os.path.join(BRAND_OUTPUT_ROOTS[brand], str(when.year), 'data', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def brand_frames(sales):
+    """Split enriched sales per brand: (brand1 lines, brand2 lines, brand1 summary, brand2 summary)."""
+    brand1 = sales.loc[sales['brand'] == 'Brand1']
+    brand2 = sales.loc[sales['brand'].isin(['brand2', 'brand3'])]
+
+    brand1file = brand1.groupby(['sku','cost'], observed=True)['qty'].sum().reset_index()
+    brand1file['total'] = brand1file['cost'] * brand1file['qty']
+
+    brand2file = brand2.groupby(['sku','cost'], observed=True)['qty'].sum().reset_index()
+    brand2file['total'] = brand2file['cost'] * brand2file['qty']
+
+    return brand1, brand2, brand1file, brand2file
+
+
+def write_brand_outputs(sales):
+    """Write the daily per-brand sales files and their sku/cost summaries."""
+    brand1, brand2, brand1file, brand2file = brand_frames(sales)
+
+    current_date = datetime.datetime.now()
+    date_str = current_date.strftime('%m-%d-%Y')
+
+    brand1.to_csv(os.path.join(daily_output_dir('brand1', current_date), f'{date_str}.csv'), index=False)
+    brand2.to_csv(os.path.join(daily_output_dir('brand2', current_date), f'{date_str}.csv'), index=False)
+    brand1file.to_csv(os.path.join('../cloudbbeh/gonder', f'{date_str}-brand1.csv'), index=False)
+    brand2file.to_csv(os.path.join('../cloudbbeh/gonder', f'{date_str}-brand2s.csv'), index=False)
+
+    return brand1file, brand2file
+
+
+def engine_outputs(sales, engine):
+    """Run the transform tail on deduplicated order lines without writing anything.
+
+    Returns the CSV text of each output the tail feeds: the retail and
+    wholesale totals (newstock.csv is derived from the wholesale totals alone)
+    and the brand line and summary files.
+    """
+    sales = normalize_sales(sales)
+    if engine == 'arrow':
+        sales = arrow_strings(sales)
+    soldvalue = retail_totals(sales, engine)
+    index = load_bundle_index()
+    final_result = component_totals_frame(index, bundle_components(soldvalue, index))
+    brand1, brand2, brand1file, brand2file = brand_frames(enrich_sales(sales))
+    return {
+        RETAIL_TOTALS_PATH: soldvalue.to_csv(),
+        WHOLESALE_TOTALS_PATH: final_result.to_csv(),
+        'brand1 lines': brand1.to_csv(index=False),
+        'brand2 lines': brand2.to_csv(index=False),
+        'brand1 summary': brand1file.to_csv(index=False),
+        'brand2 summary': brand2file.to_csv(index=False),
+    }
+
+
+def compare_engines(sales, engines=ENGINES):
+    """Run the transform tail with each engine on the same lines and compare them.
+
+    Prints the wall time, the peak Python/numpy allocations (tracemalloc) and
+    the peak Arrow memory pool usage of each engine, then every output that
+    differs from the first engine's. tracemalloc slows both engines alike.
+    Returns {engine: {'seconds', 'peak_bytes', 'arrow_peak_bytes', 'differs'}}.
+    """
+    for engine in engines:
+        require_engine(engine)
+    if pa is None:
+        raise ImportError("comparing engines needs pyarrow")
+    load_bundle_index()  # build the cached index up front so neither engine pays for it
+
+    results, reference = {}, None
+    for engine in engines:
+        default_pool = pa.default_memory_pool()
+        pool = pa.proxy_memory_pool(default_pool)
+        pa.set_memory_pool(pool)
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            outputs = engine_outputs(sales, engine)
+        finally:
+            seconds = time.perf_counter() - started
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            pa.set_memory_pool(default_pool)
+        if reference is None:
+            reference = outputs
+        results[engine] = {
+            'seconds': seconds,
+            'peak_bytes': peak_bytes,
+            'arrow_peak_bytes': pool.max_memory(),
+            'differs': [name for name in reference if outputs[name] != reference[name]],
+        }
+
+    print(f"{'engine':<8} {'seconds':>9} {'peak MiB':>9} {'arrow MiB':>10}")
+    for engine, measured in results.items():
+        print(f"{engine:<8} {measured['seconds']:>9.3f} {measured['peak_bytes'] / 2**20:>9.1f} "
+              f"{measured['arrow_peak_bytes'] / 2**20:>10.1f}")
+    for engine, measured in list(results.items())[1:]:
+        if measured['differs']:
+            print(f"{engine} differs from {engines[0]} in: {', '.join(measured['differs'])}")
+        else:
+            print(f"{engine} produces the same outputs as {engines[0]}.")
+    return results
+
+
+def write_wholesale_outputs(final_result):
+    """Attach wholesale_sold_map.csv attributes to the wholesale totals and write them per brand."""
+    wholesale_sales = final_result.copy()
+    wholesale_sales['sku'] = wholesale_sales['sku'].astype(str).str.strip()
+    wholesale_sales = pd.concat(
+        [wholesale_sales, lookup_dimension(wholesale_sales['sku'], load_dimension('wholesale_sold_map'))], axis=1)
+
+    current_date = datetime.datetime.now()
+    wholesale_sales['date'] = current_date.strftime('%m-%d-%Y')
+    wholesale_sales['Year'] = current_date.year
+    wholesale_sales['Month'] = calendar.month_name[current_date.month]
+
+    brand2 = wholesale_sales.loc[wholesale_sales['brand'].isin(['brand2', 'brand3'])]
+    brand1 = wholesale_sales.loc[wholesale_sales['brand'] == 'Brand1']
+
+    date_string = current_date.strftime('%m-%d-%Y')
+
+    brand2.to_csv(os.path.join(daily_output_dir('brand2', current_date, 'wholesale'), f'{date_string}.csv'), index=False)
+    brand1.to_csv(os.path.join(daily_output_dir('brand1', current_date, 'wholesale'), f'{date_string}.csv'), index=False)
+    return wholesale_sales
+
+
+HISTORY_DIR = '../cloudbbeh/history'
+HISTORY_ROW_GROUP_SIZE = 128_000
+UNKNOWN_BRAND = 'unknown'
+
+
+def history_partitioning():
+    return pads.partitioning(
+        pa.schema([('brand', pa.string()), ('year', pa.int16()), ('month', pa.int8())]), flavor='hive')
+
+
+def append_history(dataset, frame, run_id, when, root=HISTORY_DIR):
+    """Add one run's rows to a history dataset, partitioned as brand=/year=/month=.
+
+    Each partition gets one zstd-compressed Parquet file per run, named by
+    date and run id and sorted by SKU so row-group statistics stay selective.
+    Files are swapped in atomically and an earlier attempt of the same run is
+    replaced, so re-running a day never duplicates it. Returns the files
+    written.
+    """
+    if pa is None:
+        print(f"pyarrow is not installed; the {dataset} history store is not updated")
+        return []
+
+    frame = frame.assign(date=pd.Timestamp(when.date()))
+    brands = frame['brand'].astype('string').fillna(UNKNOWN_BRAND).to_numpy() if 'brand' in frame \
+        else np.full(len(frame), UNKNOWN_BRAND, dtype=object)
+    frame = frame.drop(columns=['brand'], errors='ignore')
+    # Plain strings keep the schema identical across files, whatever the day's categories.
+    for column in frame.columns:
+        if frame[column].dtype == object or isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype('string')
+
+    filename = f'{when:%Y-%m-%d}-{run_id}.parquet'
+    month_dirs = os.path.join(root, dataset, 'brand=*', f'year={when.year}', f'month={when.month}')
+    stale = set(glob.glob(os.path.join(month_dirs, filename)))
+    written = []
+    for brand, rows in frame.groupby(brands, sort=False):
+        directory = os.path.join(root, dataset, f"brand={urllib.parse.quote(str(brand), safe='')}",
+                                 f'year={when.year}', f'month={when.month}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, filename)
+        rows.sort_values('sku').to_parquet(f'{path}.tmp', engine='pyarrow', compression='zstd', index=False,
+                                           row_group_size=HISTORY_ROW_GROUP_SIZE)
+        os.replace(f'{path}.tmp', path)
+        stale.discard(path)
+        written.append(path)
+
+    for path in stale:
+        os.remove(path)
+    return written
+
+
+def query_history(dataset='sales', start=None, end=None, skus=None, brands=None, columns=None, root=HISTORY_DIR):
+    """Read history rows with `start` <= date <= `end` for the given SKUs and brands.
+
+    Brand, year and month filters prune whole partition directories before
+    any file is opened; date and SKU predicates are pushed down to the
+    Parquet row-group statistics. Returns a DataFrame with the partition
+    columns included.
+    """
+    if pa is None:
+        raise ImportError("query_history needs pyarrow")
+    path = os.path.join(root, dataset)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=columns)
+
+    field = pads.field
+    conditions = []
+    if brands is not None:
+        conditions.append(field('brand').isin(list(brands)))
+    if skus is not None:
+        conditions.append(field('sku').isin([str(sku) for sku in skus]))
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions.append((field('year') > start.year) | ((field('year') == start.year) & (field('month') >= start.month)))
+        conditions.append(field('date') >= start.to_pydatetime())
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append((field('year') < end.year) | ((field('year') == end.year) & (field('month') <= end.month)))
+        conditions.append(field('date') <= end.to_pydatetime())
+
+    data = pads.dataset(path, format='parquet', partitioning=history_partitioning())
+    condition = functools.reduce(lambda left, right: left & right, conditions) if conditions else None
+    return data.to_table(columns=columns, filter=condition).to_pandas()
+
+
+ROLLUP_GRAINS = {'day': '%Y-%m-%d', 'week': '%G-W%V', 'month': '%Y-%m', 'year': '%Y'}
+ROLLUP_DIMENSIONS = ('sku', 'brand', 'site')
+ROLLUP_ALL = '*'
+
+
+def rollup_cube(sales):
+    """Sum qty and total per (sku, brand, site) and per every roll-up of those.
+
+    A rolled-up dimension is stored as ROLLUP_ALL, so e.g. ('*', 'Brand1', '*')
+    holds the brand's total over all SKUs and sites. Returns
+    {(sku, brand, site): (qty, total)}.
+    """
+    base = pd.DataFrame({
+        'sku': sales['sku'].astype(str),
+        'brand': sales['brand'].astype('string').fillna(UNKNOWN_BRAND).astype(str),
+        'site': sales['site'].astype(str),
+        'qty': sales['qty'].astype('float64'),
+        'total': pd.to_numeric(sales['total'], errors='coerce').fillna(0.0),
+    })
+    cube = {}
+    for mask in range(2 ** len(ROLLUP_DIMENSIONS)):
+        kept = [name for bit, name in enumerate(ROLLUP_DIMENSIONS) if mask & (1 << bit)]
+        if kept:
+            sums = base.groupby(kept, sort=False)[['qty', 'total']].sum()
+            rows = zip(sums.index.to_flat_index(), sums['qty'], sums['total'])
+        else:
+            rows = [((), base['qty'].sum(), base['total'].sum())]
+        for values, qty, total in rows:
+            values = dict(zip(kept, values if isinstance(values, tuple) else (values,)))
+            cube[tuple(values.get(name, ROLLUP_ALL) for name in ROLLUP_DIMENSIONS)] = (float(qty), float(total))
+    return cube
+
+
+def fold_rollups(conn, run_id, sales, when):
+    """Fold a run's sales into the day/week/month/year rollups.
+
+    What the run contributed is kept per (run_id, day); folding the same run
+    again only adds the difference, so a re-run never counts its lines twice.
+    Runs are identified per day, so contributions from earlier days are
+    dropped. Returns the number of cells changed per grain.
+    """
+    day = when.strftime(ROLLUP_GRAINS['day'])
+    target = rollup_cube(sales) if len(sales) else {}
+    recorded = {
+        (sku, brand, site): (qty, total)
+        for sku, brand, site, qty, total in conn.execute(
+            'SELECT sku, brand, site, qty, total FROM rollup_contributions WHERE run_id = ? AND day = ?', (run_id, day))
+    }
+
+    deltas = {}
+    for cell in set(target) | set(recorded):
+        qty, total = target.get(cell, (0.0, 0.0))
+        recorded_qty, recorded_total = recorded.get(cell, (0.0, 0.0))
+        if qty != recorded_qty or total != recorded_total:
+            deltas[cell] = (qty - recorded_qty, total - recorded_total)
+
+    conn.execute('DELETE FROM rollup_contributions WHERE run_id = ? AND day = ?', (run_id, day))
+    conn.execute('DELETE FROM rollup_contributions WHERE day < ?', (day,))
+    conn.executemany(
+        'INSERT INTO rollup_contributions (run_id, day, sku, brand, site, qty, total) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(run_id, day, *cell, qty, total) for cell, (qty, total) in target.items()])
+    conn.executemany(
+        'INSERT INTO sales_rollups (grain, period, sku, brand, site, qty, total) VALUES (?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (grain, period, sku, brand, site) DO UPDATE '
+        'SET qty = qty + excluded.qty, total = total + excluded.total',
+        [(grain, when.strftime(period_format), *cell, qty, total)
+         for grain, period_format in ROLLUP_GRAINS.items() for cell, (qty, total) in deltas.items()])
+    return len(deltas)
+
+
+def update_rollups(sales, run_id, when):
+    """Fold an enriched sales frame into the rollup tables in one transaction."""
+    conn = state_db()
+    try:
+        with conn:
+            return fold_rollups(conn, run_id, sales, when)
+    finally:
+        conn.close()
+
+
+def rollup_period(grain, when):
+    """Return the rollup period containing `when`, e.g. rollup_period('week', date) -> '2024-W07'."""
+    return pd.Timestamp(when).strftime(ROLLUP_GRAINS[grain])
+
+
+def rollup_value(grain, period, sku=ROLLUP_ALL, brand=ROLLUP_ALL, site=ROLLUP_ALL):
+    """Return (qty, total) for one rollup cell with a single primary-key lookup.
+
+    Leave a dimension at ROLLUP_ALL to sum over it, e.g.
+    rollup_value('year', '2024', brand='Brand1') for the brand's year to date.
+    """
+    conn = state_db()
+    try:
+        row = conn.execute(
+            'SELECT qty, total FROM sales_rollups WHERE grain = ? AND period = ? AND sku = ? AND brand = ? AND site = ?',
+            (grain, period, sku, brand, site)).fetchone()
+    finally:
+        conn.close()
+    return row if row else (0.0, 0.0)
+
+
+def rollup_breakdown(grain, period, by='sku', **fixed):
+    """Return one period's rollup split by one dimension, the others fixed or summed over.
+
+    rollup_breakdown('month', '2024-02', by='site', brand='Brand1') lists the
+    brand's February qty and total per site.
+    """
+    if by not in ROLLUP_DIMENSIONS:
+        raise ValueError(f"by must be one of {ROLLUP_DIMENSIONS}, not {by!r}")
+    values = {name: fixed.get(name, ROLLUP_ALL) for name in ROLLUP_DIMENSIONS if name != by}
+    conditions = ' AND '.join(f'{name} = ?' for name in values)
+    conn = state_db()
+    try:
+        return pd.read_sql_query(
+            f'SELECT {by}, qty, total FROM sales_rollups WHERE grain = ? AND period = ? AND {conditions} '
+            f'AND {by} != ? ORDER BY qty DESC',
+            conn, params=(grain, period, *values.values(), ROLLUP_ALL))
+    finally:
+        conn.close()
+
+
+def discard_watermarks():
+    """Forget staged high-water marks from a run that did not update stock."""
+    with _watermark_lock:
+        _pending_watermarks.clear()
+
+
+STAGES = ('extract', 'local', 'transform', 'stock', 'outputs')
+
+
+def run(connectors=None, stages=STAGES, max_workers=CONNECTOR_WORKERS, timeout=CONNECTOR_TIMEOUT,
+        capture=False, replay=None, metrics_textfile=METRICS_TEXTFILE, stream=False, shards=TRANSFORM_SHARDS,
+        engine=DEFAULT_ENGINE, compare=False):
+    """Run the selected stages of the pipeline, as the command line does; see parse_args for the options.
+
+    Watermarks are only committed when the stock stage ran. Returns a dict of the frames produced.
+    """
+    require_engine(engine)
+    stages = set(stages)
+    if replay and stages & {'stock', 'outputs'}:
+        print("Replay runs never update stock or write outputs; skipping those stages.")
+        stages -= {'stock', 'outputs'}
+    if stages & {'stock', 'outputs'}:
+        stages.add('transform')
+    result = {'run_id': run_identity()}
+    frames = {}
+    begin_run_report(result['run_id'])
+    run_status = 'error'
+
+    try:
+        if stream:
+            configure_streaming(result['run_id'], check_seen=not replay)
+        if replay:
+            configure_capture('replay', replay)
+            result['capture_id'] = replay
+        elif capture:
+            result['capture_id'] = f"{result['run_id']}-{datetime.datetime.now():%H%M%S}"
+            configure_capture('capture', result['capture_id'])
+            print(f"Capturing connector payloads as {result['capture_id']}")
+
+        if 'extract' in stages:
+            selected = CONNECTORS if connectors is None else {name: CONNECTORS[name] for name in connectors}
+            results = run_connectors(selected, max_workers=max_workers, timeout=timeout)
+            report_connector_results(results)
+            frames.update({name: frame for name, (frame, total_orders, status) in results.items()})
+            result['connectors'] = results
+
+        if 'local' in stages:
+            frames.update(load_local_sales())
+        if stream and _stream['failed']:
+            raise RuntimeError(f"Streaming state failed for {', '.join(_stream['failed'])}; their lines are missing")
+        # Sources whose frames this run uses; only their streamed line keys are committed with stock.
+        sources = [name for name, (frame, total_orders, status) in result.get('connectors', {}).items()
+                   if status != 'timeout'] + [name for name in frames if name not in CONNECTORS]
+
+        if compare:
+            with span('normalize', 'dedupe', rows_in=sum(len(frame) for frame in frames.values())) as record:
+                sales, _ = dedupe_order_lines(combine_sales(frames.values()), result['run_id'],
+                                              check_seen=not replay)
+                record['rows_out'] = len(sales)
+            with span('merge', 'compare_engines', rows_in=len(sales)):
+                result['engines'] = compare_engines(sales)
+            stages -= {'transform', 'stock', 'outputs'}
+
+        if 'transform' in stages:
+            with span('normalize', 'dedupe', rows_in=sum(len(frame) for frame in frames.values())) as record:
+                sales, line_keys = dedupe_order_lines(combine_sales(frames.values()), result['run_id'],
+                                                      check_seen=not replay)
+                record['rows_out'] = len(sales)
+            enriched = False
+            if shards > 1:
+                with span('merge', 'sharded', rows_in=len(sales)) as record:
+                    enriched = 'outputs' in stages
+                    sales, soldvalue, final_result = transform_sharded(sales, shards, enrich=enriched, engine=engine,
+                                                                       publish=not replay)
+                    record.update(rows_out=len(final_result), shards=shards)
+            else:
+                with span('normalize', rows_in=len(sales)) as record:
+                    sales = normalize_sales(sales)
+                    if engine == 'arrow':
+                        sales = arrow_strings(sales)
+                    record['rows_out'] = len(sales)
+                with span('merge', 'retail_totals', rows_in=len(sales)) as record:
+                    soldvalue = summarize_retail_sales(sales, engine, publish=not replay)
+                    record['rows_out'] = len(soldvalue)
+                with span('merge', 'bundles', rows_in=len(soldvalue)) as record:
+                    final_result = expand_bundles(soldvalue, publish=not replay)
+                    record['rows_out'] = len(final_result)
+            result.update(sales=sales, soldvalue=soldvalue, final_result=final_result)
+
+            if 'stock' in stages:
+                with span('write', 'stock', rows_in=len(final_result)) as record:
+                    result['stock'] = update_stock(final_result, result['run_id'], line_keys, sources)
+                    record['rows_out'] = len(result['stock'])
+
+            if 'outputs' in stages:
+                if not enriched:
+                    with span('merge', 'enrich', rows_in=len(sales)) as record:
+                        result['sales'] = sales = enrich_sales(sales)
+                        record['rows_out'] = len(sales)
+                with span('write', 'brand_outputs', rows_in=len(sales)) as record:
+                    result['brand_files'] = write_brand_outputs(sales)
+                    record['rows_out'] = sum(len(frame) for frame in result['brand_files'])
+                with span('write', 'wholesale_outputs', rows_in=len(final_result)) as record:
+                    result['wholesale'] = write_wholesale_outputs(final_result)
+                    record['rows_out'] = len(result['wholesale'])
+                with span('write', 'history', rows_in=len(sales) + len(result['wholesale'])) as record:
+                    written_at = datetime.datetime.now()
+                    result['history'] = (append_history('sales', sales, result['run_id'], written_at)
+                                         + append_history('wholesale', result['wholesale'], result['run_id'], written_at))
+                    record['rows_out'] = len(sales) + len(result['wholesale']) if result['history'] else 0
+                if 'stock' in stages:
+                    # Only lines that left stock in this run are committed, so only they are rolled up.
+                    with span('write', 'rollups', rows_in=len(sales)) as record:
+                        record['rows_out'] = update_rollups(sales, result['run_id'], written_at)
+
+        if 'stock' in stages:
+            commit_watermarks()
+        else:
+            discard_watermarks()
+        run_status = 'ok'
+    finally:
+        configure_capture(None, None)
+        if stream:
+            configure_streaming(None)
+        result['report'] = write_run_report(run_status, textfile=metrics_textfile)
+        print(f"Run report written to {result['report']}")
+
+    print("ETL Pipeline execution completed.")
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Marketplace sales ETL and stock update.')
+    parser.add_argument('--connectors', nargs='*', choices=sorted(CONNECTORS), metavar='NAME',
+                        help='API connectors to run (default: all). Choices: %(choices)s')
+    parser.add_argument('--stages', nargs='+', choices=STAGES,
+                        help='Pipeline stages to run (default: all; without stock and outputs on --replay)')
+    parser.add_argument('--workers', type=int, default=CONNECTOR_WORKERS, help='Connectors run at once')
+    parser.add_argument('--timeout', type=float, default=CONNECTOR_TIMEOUT, help='Per-connector timeout in seconds')
+    capture = parser.add_mutually_exclusive_group()
+    capture.add_argument('--capture', action='store_true', help=f'Record raw connector payloads under {CAPTURE_DIR}')
+    capture.add_argument('--replay', metavar='CAPTURE_ID', help='Re-run from a captured run instead of the live APIs')
+    parser.add_argument('--stream', action='store_true',
+                        help='Aggregate order lines as they arrive instead of holding them all in memory')
+    parser.add_argument('--shards', type=int, default=TRANSFORM_SHARDS,
+                        help='Split the transform by SKU across this many processes (default: %(default)s)')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE,
+                        help='Transform backend (default: %(default)s)')
+    parser.add_argument('--compare-engines', action='store_true',
+                        help='Time both engines on the extracted lines and check their outputs match; writes nothing')
+    parser.add_argument('--metrics-textfile', default=METRICS_TEXTFILE, metavar='PATH',
+                        help='Prometheus textfile to write the run metrics to (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.replay and args.stages and set(args.stages) & {'stock', 'outputs'}:
+        parser.error('--replay never updates stock or writes outputs; leave stock and outputs out of --stages')
+    if args.stages is None:
+        args.stages = [stage for stage in STAGES if not (args.replay and stage in ('stock', 'outputs'))]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run(connectors=args.connectors, stages=args.stages, max_workers=args.workers, timeout=args.timeout,
+        capture=args.capture, replay=args.replay, metrics_textfile=args.metrics_textfile, stream=args.stream,
+        shards=args.shards, engine=args.engine, compare=args.compare_engines)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())